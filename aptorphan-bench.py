@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+
+# Benchmark aptorphan on synthetic universes of different sizes.
+#
+# The universes are generated by aptorphan_fake, so neither an APT
+# cache nor a Debian archive is required (only the apt_pkg module for
+# its constants). The output contains a digest
+# of the results for each size, so that changes to the hot paths can
+# be checked against fixed inputs.
+
+import argparse
+import contextlib
+import hashlib
+import io
+import sys
+import tempfile
+import time
+
+import apt_pkg
+
+import aptorphan
+import aptorphan_dpkg
+import aptorphan_fake
+from aptorphan_scripts import load_script
+
+class Timer(object):
+    def __init__(self):
+        self.phases = []
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.phases.append((name, time.perf_counter() - start))
+
+def bench_manager(universe, wishlist, timer):
+    repository = aptorphan.Repository(universe.snapshot())
+    with timer.phase('init'):
+        manager = aptorphan.Manager(repository)
+    with timer.phase('rank'):
+        for name in wishlist:
+            manager.rank_by_name(name, 'W')
+    with timer.phase('unresolved'):
+        manager.rank_unresolved()
+    output = io.StringIO()
+    with timer.phase('dump'), contextlib.redirect_stdout(output):
+        manager.dump_unresolved()
+    return hashlib.sha1(output.getvalue().encode()).hexdigest()[:12]
+
+def bench_resolver(graph, universe, wishlist, timer):
+    repository = graph.Repository(universe.snapshot())
+    with timer.phase('resolve'):
+        model = graph.Model(repository)
+        resolver = graph.Resolver(graph.Dict(), set())
+        for name in wishlist:
+            resolver.put(model.find_candidate_version_by_name(name))
+        for priority in sorted(graph.Global.priorities):
+            for version in model.find_versions_by_priority(priority):
+                resolver.put(version)
+        expected = resolver.resolve()
+    ids = ','.join(str(id) for id in sorted(v.id() for v in expected))
+    return hashlib.sha1(ids.encode()).hexdigest()[:12]
+
+def bench_status(universe, timer):
+    # The dpkg status file has the typical size of about 1 KiB per
+    # installed package, and it is parsed from the page cache.
+    with tempfile.NamedTemporaryFile('w', suffix='.status') as f:
+        f.write(universe.status())
+        f.flush()
+        with timer.phase('status'):
+            aptorphan_dpkg.read_status(apt_pkg, f.name, universe.architectures[0])
+
+# The digests of fixed inputs, checked by --check and the tests. They
+# only change, if the output of aptorphan or the resolution of the graph
+# changes. If such a change is intended, run 'aptorphan-bench.py --check'
+# and replace each failed digest with the new one it reports (the part
+# after 'digest='). Check the new output first, e.g. with aptorphan.py
+# before and after the change, and mention the changed digests in the
+# commit.
+EXPECTED = [
+    # (size, seed, options, digest)
+    (2000, 0, {}, '9a757ee59b00/15cdf54d4283'),
+    (2000, 1, {'or_ratio': 0.3, 'conflicts_ratio': 0.05}, '019ff4fdb6a3/2facff52e63d'),
+    (5000, 2, {'virtual_ratio': 0.05, 'multiarch_ratio': 0.2}, '1bf4d0499d73/1881b7ec9154'),
+    (5000, 3, {'or_ratio': 0.4, 'conflicts_ratio': 0.1, 'upgrade_ratio': 0.2}, '27cea3a34338/893843f2ca65'),
+    ]
+
+def bench(graph, size, seed=0, wishlist=200, repeat=1, **options):
+    # Returns the time to generate the universe, the best time of each
+    # phase and the set of digests.
+    start = time.perf_counter()
+    universe = aptorphan_fake.Universe(size, seed=seed, **options)
+    generated = time.perf_counter() - start
+    step = max(1, size // wishlist)
+    names = universe.names[::step][:wishlist]
+    best = {}
+    digests = set()
+    for i in range(repeat):
+        timer = Timer()
+        digests.add('{}/{}'.format(
+            bench_manager(universe, names, timer),
+            bench_resolver(graph, universe, names, timer)))
+        bench_status(universe, timer)
+        for name, seconds in timer.phases:
+            best[name] = min(best.get(name, seconds), seconds)
+    return generated, best, digests
+
+def check(graph):
+    # Returns the cases with unexpected digests.
+    failed = []
+    for size, seed, options, digest in EXPECTED:
+        generated, best, digests = bench(graph, size, seed, **options)
+        if digests != {digest}:
+            failed.append((size, seed, options, digest, digests))
+    return failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark aptorphan on synthetic universes.')
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        help='comma separated list of universe sizes (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--wishlist', type=int, default=200, help='number of wishlist entries (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1, help='report the best of several runs')
+    parser.add_argument('--or-ratio', type=float, default=0.1)
+    parser.add_argument('--conflicts-ratio', type=float, default=0.02)
+    parser.add_argument('--virtual-ratio', type=float, default=0.02)
+    parser.add_argument('--multiarch-ratio', type=float, default=0.1)
+    parser.add_argument('--check', action='store_true',
+                        help='only compare the digests of the fixed inputs with the expected values')
+    args = parser.parse_args()
+    graph = load_script('aptorphan-graph.py')
+    write = lambda format, *args: sys.stdout.write(format.format(*args))
+    if args.check:
+        failed = check(graph)
+        for size, seed, options, digest, digests in failed:
+            write('size={} seed={} {} expected={} digest={}\n', size, seed, options, digest, ','.join(sorted(digests)))
+        write('{} of {} cases failed\n', len(failed), len(EXPECTED))
+        sys.exit(1 if failed else 0)
+    for size in map(int, args.sizes.split(',')):
+        generated, best, digests = bench(
+            graph, size, args.seed, args.wishlist, args.repeat, or_ratio=args.or_ratio,
+            conflicts_ratio=args.conflicts_ratio, virtual_ratio=args.virtual_ratio,
+            multiarch_ratio=args.multiarch_ratio)
+        write('size={} generate={:.3f}s {} digest={}\n', size, generated,
+              ' '.join('{}={:.3f}s'.format(name, seconds) for name, seconds in best.items()),
+              ','.join(sorted(digests)))
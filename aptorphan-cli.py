@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+
+# Run several aptorphan commands against a single load of the APT
+# cache, for example:
+#
+#     aptorphan-cli.py --snapshot report base.conf + graph --output graph.dot base.conf
+#
+# The commands are separated by '+'. Each command writes to stdout
+# unless it has its own --output. The options before the first command
+# apply to all of them.
+
+import argparse
+import contextlib
+import sys
+
+import aptorphan
+import aptorphan_profile
+import aptorphan_repository
+from aptorphan_scripts import load_script
+
+def add_commands(parser, commands):
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+    for name, (module, help) in commands.items():
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument('--output', metavar='PATH', help='write the output to PATH instead of stdout')
+        module.add_arguments(subparser)
+
+def split_commands(argv):
+    result = [[]]
+    for arg in argv:
+        if arg == '+':
+            result.append([])
+        else:
+            result[-1].append(arg)
+    return result
+
+@contextlib.contextmanager
+def open_output(pathname):
+    if pathname is None:
+        yield
+    else:
+        with open(pathname, 'w') as f, contextlib.redirect_stdout(f):
+            yield
+
+if __name__ == '__main__':
+    commands = {
+        'report': (aptorphan, 'show packages, which should be installed or removed'),
+        'conf': (load_script('aptorphan-conf.py'), 'create an initial configuration file'),
+        'graph': (load_script('aptorphan-graph.py'), 'show the difference between expected and installed packages as DOT graph'),
+    }
+    phases = ['open']
+    for module, help in commands.values():
+        phases.extend(phase for phase in module.PHASES if phase not in phases)
+    parser = argparse.ArgumentParser(
+        description='Run several aptorphan commands against the same APT cache.',
+        epilog="Separate several commands with '+'.")
+    aptorphan_repository.add_arguments(parser)
+    aptorphan_profile.add_arguments(parser, phases, 'base')
+    add_commands(parser, commands)
+    following = argparse.ArgumentParser(prog='{} ... +'.format(parser.prog))
+    add_commands(following, commands)
+    segments = split_commands(sys.argv[1:])
+    args = parser.parse_args(segments[0])
+    # All command lines are parsed before the cache is opened, so that
+    # usage errors are reported immediately.
+    steps = [ args ] + [ following.parse_args(segment) for segment in segments[1:] ]
+    profiler = aptorphan_profile.from_arguments(args)
+    with profiler.phase('open'):
+        repository = aptorphan_repository.from_arguments(args)
+    # A command, that reports failures (e.g. of --multi profiles),
+    # returns a true value. The remaining commands are run anyway.
+    failed = False
+    for step in steps:
+        with open_output(step.output):
+            failed = commands[step.command][0].run(step, repository, profiler) or failed
+    profiler.report()
+    sys.exit(1 if failed else 0)
@@ -23,40 +23,48 @@
 #     Package tree limit ('l'): "~i !~M"
 #     For each unfamiliar package: 'M'
 
+import argparse
 import sys
 
 import apt_pkg
 
-class Dict(dict):
-    def compute_if_absent(self, key, mapping):
-        try:
-            return self[key]
-        except KeyError:
-            pass # unwind exception stack
-        return self.setdefault(key, mapping(key))
-
-class Repository(object):
-    def __init__(self):
-        apt_pkg.init()
-        cache = apt_pkg.Cache(progress=None)
-        depcache = apt_pkg.DepCache(cache)
-        self.find_packages = lambda: cache.packages
-        self.is_auto_installed = depcache.is_auto_installed
+import aptorphan_profile
+import aptorphan_repository
+from aptorphan_repository import Dict
 
-if __name__ == '__main__':
-    repository = Repository()
+PHASES = ['scan', 'output']
+
+def add_arguments(parser):
+    pass
+
+def run(args, repository, profiler):
+    profiler.switch('scan')
     priorities = {apt_pkg.PRI_REQUIRED, apt_pkg.PRI_IMPORTANT, apt_pkg.PRI_STANDARD}
     sections = Dict()
     for p in repository.find_packages():
-        v = p.current_ver
+        v = repository.find_current_version(p)
         if v and (v.priority not in priorities) and not repository.is_auto_installed(p):
             pf = v.file_list[0][0]
             names = sections.compute_if_absent(
                 '{}: {}/{}'.format(pf.origin, v.section, pf.component),
                 lambda section: [])
             names.append(p.get_fullname(pretty=True))
+    profiler.switch('output')
     sys.stdout.write('{\n')
     for section, names in sorted(sections.items()):
         sys.stdout.write('\n    # {}\n'.format(section))
         sys.stdout.write(''.join(map('    {!r},\n'.format, sorted(names))))
     sys.stdout.write('\n}\n')
+    profiler.switch()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create an initial configuration file for aptorphan.')
+    aptorphan_repository.add_arguments(parser)
+    add_arguments(parser)
+    aptorphan_profile.add_arguments(parser, ['open'] + PHASES, 'scan')
+    args = parser.parse_args()
+    profiler = aptorphan_profile.from_arguments(args)
+    profiler.switch('open')
+    repository = aptorphan_repository.from_arguments(args)
+    run(args, repository, profiler)
+    profiler.report()
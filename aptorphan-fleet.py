@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+
+# Compare the installed packages of many hosts against one archive.
+#
+# The manifest is a Python literal, that maps each host name to the
+# dpkg status file, the extended_states file of APT and the
+# configuration files of the host, for example:
+#
+#     {
+#         'web1': {'status': 'web1/status', 'extended_states': 'web1/extended_states',
+#                  'configs': ['base.conf', 'web.conf']},
+#     }
+#
+# Relative paths are resolved against the directory of the manifest.
+# The archive is loaded once, and each distinct wishlist is ranked
+# once, because the ranking does not depend on the installed state.
+# The base packages are ranked only for the first wishlist, and the
+# others continue from a checkpoint of that state, like --checkpoint.
+# The reports are created in a pool of worker processes, each forked
+# from the ranked state for a single host.
+
+import argparse
+import ast
+import io
+import multiprocessing
+import os
+import sys
+
+import apt_pkg
+
+import aptorphan
+import aptorphan_dpkg
+import aptorphan_profile
+import aptorphan_repository
+
+class Fleet(object):
+    def __init__(self, repository, profiler=None, format='text'):
+        self.__repository = repository
+        self.__profiler = profiler or aptorphan_profile.Profiler()
+        self.__format = format
+        self.__managers = {} # wishlist => manager
+        self.__checkpoint = None # state after ranking the base packages
+    def rank(self, wishlist):
+        if wishlist not in self.__managers:
+            if self.__checkpoint is None:
+                manager = aptorphan.Manager(self.__repository, self.__profiler)
+                self.__checkpoint = manager.export_checkpoint()
+            else:
+                manager = aptorphan.Manager(self.__repository, self.__profiler, checkpoint=self.__checkpoint)
+            for package_name in wishlist:
+                manager.rank_by_name(package_name, 'W')
+            manager.rank_unresolved()
+            manager.release()
+            self.__managers[wishlist] = manager
+    def report(self, host):
+        # Runs in a worker process, so that neither the installed state
+        # nor the changes made by dump_unresolved leak into other hosts.
+        # Returns the report and whether it failed.
+        name, status, extended_states, wishlist = host
+        output = io.StringIO()
+        if self.__format == 'jsonl':
+            writer = aptorphan.JsonWriter(output, host=name)
+        else:
+            writer = aptorphan.TextWriter(output)
+            output.write('HOST: {}\n'.format(name))
+        try:
+            native = self.__repository.find_architectures()[0]
+            self.__repository.use_installed_state(aptorphan_dpkg.load(apt_pkg, status, extended_states, native))
+            self.__managers[wishlist].dump_unresolved(writer=writer)
+        except Exception as e:
+            writer.error(str(e))
+            return output.getvalue(), True
+        return output.getvalue(), False
+
+def read_manifest(pathname):
+    base = os.path.dirname(pathname)
+    resolve = lambda path: os.path.join(base, path)
+    with open(pathname, 'r') as f:
+        manifest = ast.literal_eval(f.read())
+    wishlists = {}
+    hosts = []
+    for name, entry in manifest.items():
+        configs = tuple(map(resolve, entry.get('configs', ())))
+        if configs not in wishlists:
+            wishlist = []
+            for config in configs:
+                with open(config, 'r') as f:
+                    wishlist.extend(ast.literal_eval(f.read()))
+            wishlists[configs] = tuple(wishlist)
+        extended_states = entry.get('extended_states')
+        hosts.append((name, resolve(entry['status']), extended_states and resolve(extended_states), wishlists[configs]))
+    return hosts
+
+_fleet = None # inherited by the forked workers
+
+def _report(host):
+    return _fleet.report(host)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show packages, which should be installed or removed, for many hosts.')
+    aptorphan_repository.add_arguments(parser)
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help='print the reports as text or as one JSON object per line (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes creating the reports (default: %(default)s)')
+    aptorphan_profile.add_arguments(parser, ['open', 'candidates', 'base', 'wishlist', 'report'], 'wishlist')
+    parser.add_argument('manifest', metavar='MANIFEST')
+    args = parser.parse_args()
+    profiler = aptorphan_profile.from_arguments(args)
+    hosts = read_manifest(args.manifest)
+    with profiler.phase('open'):
+        repository = aptorphan_repository.from_arguments(args)
+    _fleet = Fleet(repository, profiler, args.format)
+    with profiler.phase('wishlist'):
+        for host in hosts:
+            _fleet.rank(host[3])
+    failed = False
+    with profiler.phase('report'):
+        with multiprocessing.get_context('fork').Pool(args.jobs, maxtasksperchild=1) as pool:
+            for report, error in pool.imap(_report, hosts):
+                sys.stdout.write(report)
+                failed = failed or error
+    profiler.report()
+    sys.exit(1 if failed else 0)
@@ -1,27 +1,17 @@
 #! /usr/bin/env python3
 
+import argparse
 import sys
 
 import apt_pkg
 import ast
+import heapq
 
-class Dict(dict):
-    def compute_if_absent(self, key, mapping):
-        try:
-            return self[key]
-        except KeyError:
-            pass # unwind exception stack
-        return self.setdefault(key, mapping(key))
-
-class Repository(object):
-    def __init__(self):
-        apt_pkg.init()
-        cache = apt_pkg.Cache(progress=None)
-        depcache = apt_pkg.DepCache(cache)
-        self.find_packages = lambda: cache.packages
-        self.find_candidate_version = depcache.get_candidate_ver
-        self.find_package_by_name = lambda name: cache[name] if name in cache else None
-        self.is_auto_installed = depcache.is_auto_installed
+import aptorphan_depends
+import aptorphan_names
+import aptorphan_profile
+import aptorphan_repository
+from aptorphan_repository import Dict, Repository
 
 class Global(object):
     priorities = {'required', 'important', 'standard'}
@@ -35,12 +25,26 @@ class Model(object):
             self.repository = repository
             self.packages = Dict()
             self.versions = Dict()
+            self.table = aptorphan_depends.DependencyTable(self.version)
+            # The candidate versions and the index for the priority
+            # queries are built in a single pass over all packages.
+            self.candidates = {} # package id => candidate version id
+            # The package files are only looked at, if the versions are
+            # filtered by origin or component.
+            self.priorities = Dict() # (priority, arch) => versions
+            for p in repository.find_packages():
+                if p.has_versions:
+                    v = repository.find_candidate_version(p)
+                    if v is None: continue
+                    self.candidates[p.id] = v.id
+                    self.priorities.compute_if_absent((v.priority, v.arch), lambda key: []).append(v)
         def package(self, package):
             return self.packages.compute_if_absent(package.id, lambda id: Model.Package(self, package))
         def version(self, version):
             return self.versions.compute_if_absent(version.id, lambda id: Model.Version(self, version))
 
     class Package(object):
+        __slots__ = ('__impl', '__underlying')
         def __init__(self, impl, underlying):
             self.__impl = impl
             self.__underlying = underlying
@@ -48,45 +52,53 @@ class Model(object):
             return self.__underlying.get_fullname(pretty=True)
 
     class Version(object):
+        __slots__ = ('__impl', '__underlying', '__id', '__candidate')
         def __init__(self, impl, underlying):
             self.__impl = impl
             self.__underlying = underlying
+            self.__id = underlying.id
+            self.__candidate = impl.candidates.get(underlying.parent_pkg.id) == underlying.id
         def package(self):
             return self.__impl.package(self.__underlying.parent_pkg)
         def is_candidate_version(self):
-            return self.__impl.repository.find_candidate_version(
-                self.__underlying.parent_pkg).id == self.__underlying.id
+            return self.__candidate
         __suppress_empty_dependency = {'Conflicts', 'Replaces', 'Breaks', 'Suggests', 'Enhances', 'Recommends'}
         def relates(self, kinds=None):
-            for kind, and_group in self.__underlying.depends_list.items():
-                if kinds is None or kind in kinds:
-                    for or_group in and_group:
-                        targets = self.__expand_or_group(or_group)
-                        if targets:
-                            yield kind, targets
-                        elif kind not in Model.Version.__suppress_empty_dependency:
-                            raise Exception('invalid dependency', self.display_name(), kind, or_group)
-        def __expand_or_group(self, or_group):
-            # keep the original order
-            result = []
-            seen = set()
-            for dependency in or_group:
-                for target in map(self.__impl.version, dependency.all_targets()):
-                    if target not in seen:
-                        result.append(target)
-                        seen.add(target)
-            return result
+            for kind, or_group, targets in self.__impl.table.groups(self.__underlying, kinds):
+                if targets:
+                    yield kind, targets
+                elif kind not in Model.Version.__suppress_empty_dependency:
+                    raise Exception('invalid dependency', self.display_name(), kind, or_group)
+        def parents(self):
+            # Yields the versions, that may depend on this version. They
+            # are found through the reverse dependencies of the package
+            # and of the virtual packages provided by this version.
+            repository = self.__impl.repository
+            packages = [self.__underlying.parent_pkg]
+            for name, version, _ in self.__underlying.provides_list:
+                p = repository.find_package_by_name('{}:{}'.format(name, self.__underlying.parent_pkg.architecture))
+                if p is not None:
+                    packages.append(p)
+            for p in packages:
+                for dependency in p.rev_depends_list:
+                    yield self.__impl.version(dependency.parent_ver)
         def id(self):
-            return self.__underlying.id
+            return self.__id
         def display_name(self):
             return self.__underlying.parent_pkg.get_fullname(pretty=True)
 
     def __init__(self, repository):
         self.__impl = Model.Impl(repository)
+    def stats(self):
+        return {
+            'versions wrapped': len(self.__impl.versions),
+            'or-groups expanded': self.__impl.table.stats['expanded'],
+            'expansions saved': self.__impl.table.stats['saved'],
+            }
     def find_installed_versions(self):
         result = []
         for p in self.__impl.repository.find_packages():
-            v = p.current_ver
+            v = self.__impl.repository.find_current_version(p)
             if v is not None:
                 result.append(v)
         # sort the versions by name to make the result deterministic
@@ -99,20 +111,45 @@ class Model(object):
             'optional':apt_pkg.PRI_OPTIONAL,
             'extra':apt_pkg.PRI_EXTRA,
         }[priority_name]
-        foreign = frozenset(apt_pkg.get_architectures()[1:])
+        foreign = frozenset(self.__impl.repository.find_architectures()[1:])
         result = []
-        for p in self.__impl.repository.find_packages():
-            if p.has_versions:
-                v = self.__impl.repository.find_candidate_version(p)
-                if v is None: continue
-                if v.priority != priority: continue
-                if v.arch in foreign: continue
-                pf = v.file_list[0][0]
-                if origins and pf.origin not in origins: continue
-                if components and pf.component not in components: continue
+        for (p, arch), versions in self.__impl.priorities.items():
+            if p != priority: continue
+            if arch in foreign: continue
+            for v in versions:
+                if origins or components:
+                    pf = v.file_list[0][0]
+                    if origins and pf.origin not in origins: continue
+                    if components and pf.component not in components: continue
                 result.append(v)
         # sort the versions by name to make the result deterministic
         return map(self.__impl.version, sorted(result, key=lambda v: v.parent_pkg.name))
+    def find_candidate_versions_by_name(self, name):
+        # Patterns are expanded to the candidate versions of all
+        # matching packages.
+        if not aptorphan_names.is_pattern(name):
+            return [ self.find_candidate_version_by_name(name) ]
+        repository = self.__impl.repository
+        result = [ v for v in map(repository.find_candidate_version, repository.find_packages_by_pattern(name)) if v is not None ]
+        if not result:
+            raise Exception('no package matches: {}'.format(name))
+        return list(map(self.__impl.version, result))
+    def find_versions_by_name(self, name):
+        # Returns the candidate and the installed versions of the
+        # packages matching the name.
+        repository = self.__impl.repository
+        if aptorphan_names.is_pattern(name):
+            packages = repository.find_packages_by_pattern(name)
+        else:
+            packages = [ repository.find_package_by_name(name) ]
+            if packages[0] is None:
+                raise Exception('unknown package: {}'.format(name))
+        result = []
+        for p in packages:
+            for v in (repository.find_candidate_version(p) if p.has_versions else None, repository.find_current_version(p)):
+                if v is not None and self.__impl.version(v) not in result:
+                    result.append(self.__impl.version(v))
+        return result
     def find_candidate_version_by_name(self, name):
         p = self.__impl.repository.find_package_by_name(name)
         if p is None:
@@ -126,64 +163,227 @@ class Model(object):
         return self.__impl.version(p.provides_list[0][2])
 
 class Resolver(object):
-    def __init__(self, versions=Dict(), conflicts=set()):
-        self.__versions = versions
-        self.__conflicts = conflicts
-        self.__pending = []
+    # The pending dependencies are kept as entries with a unique sort
+    # key (display name of the source, sequence number). The result is
+    # the same as processing all pending entries in sorted order again
+    # and again. However, an entry can only change if one of its
+    # targets has been put or has got a conflict. So each round only
+    # examines the new entries and the entries affected by such an
+    # event. Similarly, the votes for the designated targets are
+    # updated whenever an entry changes.
+    def __init__(self, versions=None, conflicts=None):
+        self.__versions = Dict() if versions is None else versions
+        self.__conflicts = set() if conflicts is None else conflicts
+        self.__names = Dict()
+        self.__sequence = 0
+        self.__entries = {} # seq => [key, source, targets]
+        self.__watchers = {} # version => seqs of entries containing the version
+        self.__new = set()
+        self.__dirty = set()
+        self.__votes = ({}, {}) # version => seqs of entries voting for the version
+        self.__heaps = ([], [])
+        self.__predicates = (Model.Version.is_candidate_version, lambda v: True)
+    def __name(self, version):
+        return self.__names.compute_if_absent(version, lambda version: version.package().display_name())
     def put(self, version):
         def handler(source):
             for kind, targets in version.relates(Global.depends):
-                self.__pending.append((source, targets))
+                self.__add_entry(source, targets)
             for kind, targets in version.relates(Global.conflicts):
-                self.__conflicts.update(targets)
-        self.__versions.compute_if_absent(version, handler)
-    def __sort_pending(self):
-        self.__pending.sort(key=lambda t: t[0].package().display_name())
-    def __take_pending(self):
-        self.__pending, result = [], self.__pending
-        return result
+                for target in targets:
+                    if target not in self.__conflicts:
+                        self.__conflicts.add(target)
+                        self.__dirty.update(self.__watchers.get(target, ()))
+        if version not in self.__versions:
+            self.__versions.compute_if_absent(version, handler)
+            # all entries containing the version are fulfilled
+            for seq in list(self.__watchers.get(version, ())):
+                self.__remove_entry(seq)
+    def __add_entry(self, source, targets):
+        if any(v in self.__versions for v in targets):
+            return # already fulfilled
+        self.__sequence += 1
+        seq = self.__sequence
+        self.__entries[seq] = [(self.__name(source), seq), source, targets]
+        for target in targets:
+            self.__watchers.setdefault(target, set()).add(seq)
+        self.__vote(seq, None, targets)
+        self.__new.add(seq)
+    def __remove_entry(self, seq):
+        key, source, targets = self.__entries.pop(seq)
+        for target in targets:
+            self.__watchers[target].discard(seq)
+        self.__vote(seq, targets, None)
+    def __update_entry(self, seq, targets):
+        entry = self.__entries[seq]
+        for target in entry[2]:
+            if target not in targets:
+                self.__watchers[target].discard(seq)
+        self.__vote(seq, entry[2], targets)
+        entry[2] = targets
+    def __vote(self, seq, old, new):
+        for votes, heap, predicate in zip(self.__votes, self.__heaps, self.__predicates):
+            before = next((t for t in old if predicate(t)), None) if old is not None else None
+            after = next((t for t in new if predicate(t)), None) if new is not None else None
+            if before is after:
+                continue
+            for version, update in ((before, set.discard), (after, set.add)):
+                if version is not None:
+                    voters = votes.setdefault(version, set())
+                    update(voters, seq)
+                    if voters:
+                        self.__sequence += 1
+                        heapq.heappush(heap, (-len(voters), self.__name(version), self.__sequence, version))
     def resolve(self):
         while True:
             while self.__resolve_all_trivial_targets():
                 pass
-            if self.__resolve_one_designated_target(Model.Version.is_candidate_version):
+            if self.__resolve_one_designated_target(0):
                 continue
-            elif self.__resolve_one_designated_target(lambda v: True):
+            elif self.__resolve_one_designated_target(1):
                 continue
             else:
                 return frozenset(self.__versions)
     def __resolve_all_trivial_targets(self):
         progress = False
-        self.__sort_pending() # sort for deterministic behavior
-        for source, targets in self.__take_pending():
-            if any(v in self.__versions for v in targets):
+        heap = [ self.__entries[seq][0] for seq in self.__new | self.__dirty if seq in self.__entries ]
+        heapq.heapify(heap) # sort for deterministic behavior
+        scheduled = { seq for name, seq in heap }
+        self.__new, self.__dirty = set(), set()
+        while heap:
+            key = heapq.heappop(heap)
+            scheduled.discard(key[1])
+            entry = self.__entries.get(key[1])
+            if entry is None:
                 continue # already fulfilled
-            targets = [t for t in targets if t not in self.__conflicts]
-            if len(targets) == 0:
-                pass # silently ignore unresolvable dependency
-            elif len(targets) > 1:
-                self.__pending.append((source, targets))
-            elif targets[0].is_candidate_version():
-                self.put(targets[0])
+            if self.__resolve_entry(key[1], entry[2]):
                 progress = True
-            else:
-                self.__pending.append((source, targets))
+                # Entries affected by the new version are examined in
+                # this round, if they come after the current entry.
+                # All other entries are examined in the next round.
+                later = set()
+                for seq in self.__dirty:
+                    if seq in self.__entries and seq not in scheduled and seq not in self.__new:
+                        if self.__entries[seq][0] > key:
+                            heapq.heappush(heap, self.__entries[seq][0])
+                            scheduled.add(seq)
+                        else:
+                            later.add(seq)
+                self.__dirty = later
         return progress
-    def __resolve_one_designated_target(self, predicate):
-        counter = {}
-        for source, targets in self.__pending:
-            targets = [t for t in targets if predicate(t)]
-            if targets:
-                target = targets[0]
-                counter[target] = counter.get(target, 0) + 1
-        if counter:
-            candidate = sorted(counter.items(), key=lambda item: (-item[1], item[0].package().display_name()))[0][0]
-            self.put(candidate)
+    def __resolve_entry(self, seq, targets):
+        targets = [t for t in targets if t not in self.__conflicts]
+        if len(targets) == 0:
+            self.__remove_entry(seq) # silently ignore unresolvable dependency
+        elif len(targets) > 1:
+            self.__update_entry(seq, targets)
+        elif targets[0].is_candidate_version():
+            self.__remove_entry(seq)
+            self.put(targets[0])
             return True
+        else:
+            self.__update_entry(seq, targets)
         return False
+    def __resolve_one_designated_target(self, index):
+        votes, heap = self.__votes[index], self.__heaps[index]
+        best = []
+        while heap and (not best or heap[0][:2] == best[0][:2]):
+            item = heapq.heappop(heap)
+            if len(votes.get(item[3], ())) == -item[0] and all(item[3] is not b[3] for b in best):
+                best.append(item)
+        if not best:
+            return False
+        # Ties between versions with the same display name are decided
+        # by the first entry voting for them.
+        candidate = min(best, key=lambda item: min(self.__entries[seq][0] for seq in votes[item[3]]))
+        for item in best:
+            if item is not candidate:
+                heapq.heappush(heap, item)
+        self.put(candidate[3])
+        return True
 
-if __name__ == '__main__':
+def find_components(nodes, successors):
+    # Returns the strongly connected components in reverse topological
+    # order, i.e. each component after all components reachable from
+    # it (Tarjan's algorithm without recursion).
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    result = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors(root)))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors(child))))
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member is node:
+                            break
+                    result.append(component)
+    return result
+
+def find_redundant_edges(components, successors):
+    # Returns the edges (source, target), that are implied by a longer
+    # path between the components. The components reachable from each
+    # component are kept as bitsets over the component numbers.
+    number = { node: n for n, component in enumerate(components) for node in component }
+    children = []
+    reach = []
+    for n, component in enumerate(components):
+        children.append({ number[child] for node in component for child in successors(node) } - {n})
+        bits = 0
+        for m in children[n]:
+            bits |= (1 << m) | reach[m]
+        reach.append(bits)
+    result = set()
+    for n, component in enumerate(components):
+        for node in component:
+            for child in successors(node):
+                m = number[child]
+                if m != n and any(reach[k] >> m & 1 for k in children[n] if k != m):
+                    result.add((node, child))
+    return result
+
+PHASES = ['config', 'resolve', 'installed', 'anchors', 'prune', 'output']
 
+def add_arguments(parser):
+    parser.add_argument('--focus', metavar='NAME', action='append',
+                        help='only show the versions of the package NAME and their neighbourhood (can be repeated)')
+    parser.add_argument('--depth', type=int, default=2,
+                        help='number of dependencies followed from the packages given by --focus (default: %(default)s)')
+    parser.add_argument('--reduce', action='store_true',
+                        help='omit dependencies, that are implied by a longer chain of dependencies')
+    parser.add_argument('--collapse', action='store_true',
+                        help='show cyclic dependencies as a single node')
+    parser.add_argument('--max-nodes', type=int, metavar='N',
+                        help='show at most N versions, preferring guards, missing and spurious versions')
+    parser.add_argument('--debug', action='store_true', help='print statistics to stderr')
+    parser.add_argument('configs', metavar='CONFIG', nargs='*')
+
+def read_config(args):
     # Step 1: Find all versions which are expected to be
     # installed. This step completely ignores whether the version is
     # currently installed or not.
@@ -192,17 +392,22 @@ if __name__ == '__main__':
     # Explicits: All versions directly configured by the user in a
     # configuration file passed to the application. Note that a
     # version might be configured in more than one configuration file.
-    for pathname in sys.argv[1:]:
+    for pathname in args.configs:
         filename = pathname.split('/')[-1]
         with open(pathname, 'r') as f:
             for name in ast.literal_eval(f.read()):
                 config.compute_if_absent(name, lambda name: []).append(filename)
+    return config
 
-    # Late initialization of repository, so that syntax errors in the
-    # configuration files can be reported immediately.
-    model = Model(Repository())
-    config = Dict((model.find_candidate_version_by_name(name), filenames)
-                  for name, filenames in sorted(config.items()))
+def run(args, repository, profiler, config=None):
+    if config is None:
+        config = read_config(args)
+    profiler.switch('config')
+    model = Model(repository)
+    names, config = config, Dict()
+    for name, filenames in sorted(names.items()):
+        for version in model.find_candidate_versions_by_name(name):
+            config.compute_if_absent(version, lambda version: []).extend(filenames)
 
     # Implicits: All versions with high priority. These versions
     # should always be installed in a standard setup.
@@ -213,6 +418,7 @@ if __name__ == '__main__':
     # Inference: Starting with the explicitly and implicitly selected
     # versions, recursively infer further versions that are expected
     # to be installed based on their dependencies.
+    profiler.switch('resolve')
     resolver = Resolver()
     for version in config:
         resolver.put(version)
@@ -221,6 +427,7 @@ if __name__ == '__main__':
     # Step 2: Find all versions, which are actually installed, and
     # determine the difference between the actual and the expected
     # set.
+    profiler.switch('installed')
     actual = set(model.find_installed_versions())
     missing = expected - actual
     spurious = actual - expected
@@ -229,20 +436,59 @@ if __name__ == '__main__':
     # and actual. These versions will be shown in addition to missing
     # and spurious versions, because these versions explain, why a
     # missing version should actually be installed.
-    def find_parents(candidates, children):
-        for candidate in candidates:
+    profiler.switch('anchors')
+    if args.focus:
+        # Focus: Only the neighbourhood of the given packages is shown.
+        # It is found with a breadth-first search in both directions
+        # through the expected and installed versions, bounded by the
+        # depth, so that no index over all versions is needed.
+        relevant = expected | actual
+        depends = lambda version: [ target for kind, targets in version.relates(Global.depends) for target in targets ]
+        frontier = []
+        for name in args.focus:
+            found = [ version for version in model.find_versions_by_name(name) if version in relevant ]
+            if not found:
+                raise Exception('neither expected nor installed: {}'.format(name))
+            frontier.extend(found)
+        neighbourhood = set(frontier)
+        for depth in range(args.depth):
+            following = []
+            for version in frontier:
+                children = [ target for target in depends(version) if target in relevant ]
+                parents = [ parent for parent in version.parents() if parent in relevant and version in depends(parent) ]
+                for neighbour in children + parents:
+                    if neighbour not in neighbourhood:
+                        neighbourhood.add(neighbour)
+                        following.append(neighbour)
+            frontier = following
+        anchors = neighbourhood & expected & actual
+        missing &= neighbourhood
+        spurious &= neighbourhood
+        guards = { target for anchor in anchors for target in depends(anchor) if target in missing }
+        guards |= missing & config.keys()
+        missing -= guards
+    else:
+        # The reverse dependencies of the expected and installed versions
+        # are indexed once, so that the anchors can be found with a
+        # backward search from the missing versions.
+        parents = {}
+        for candidate in expected & actual:
             for kind, targets in candidate.relates(Global.depends):
-                if any(target in children for target in targets):
-                    yield candidate
-    anchors = set()
-    anchors_aux = set(find_parents(expected & actual, missing - config.keys()))
-    while anchors_aux:
-        anchors.update(anchors_aux)
-        anchors_aux = set(find_parents((expected & actual) - anchors, anchors_aux - config.keys()))
-
-    guards = {target for anchor in anchors for kind, targets in anchor.relates(Global.depends) for target in targets if target in missing}
-    guards |= missing & config.keys()
-    missing -= guards
+                for target in targets:
+                    parents.setdefault(target, set()).add(candidate)
+        anchors = set()
+        children = list(missing - config.keys())
+        while children:
+            child = children.pop()
+            for parent in parents.get(child, ()):
+                if parent not in anchors:
+                    anchors.add(parent)
+                    if parent not in config:
+                        children.append(parent)
+
+        guards = {target for target in missing if not anchors.isdisjoint(parents.get(target, ()))}
+        guards |= missing & config.keys()
+        missing -= guards
 
     versions = {}
     versions.update(dict.fromkeys(anchors, 'anchor'))
@@ -250,6 +496,40 @@ if __name__ == '__main__':
     versions.update(dict.fromkeys(missing, 'missing'))
     versions.update(dict.fromkeys(spurious, 'spurious'))
 
+    # Optionally prune the graph, so that Graphviz can lay it out in
+    # reasonable time. Only the definite dependencies (without
+    # alternatives) between the shown versions are considered.
+    profiler.switch('prune')
+    omitted = 0
+    if args.max_nodes is not None and len(versions) > args.max_nodes:
+        priority = {'guards': 0, 'missing': 1, 'spurious': 2, 'anchor': 3}
+        shown = sorted(versions, key=lambda v: (priority[versions[v]], v.display_name(), v.id()))[:args.max_nodes]
+        omitted = len(versions) - len(shown)
+        versions = { version: versions[version] for version in shown }
+    components = []
+    redundant = set() # definite dependencies implied by a longer chain
+    if args.reduce or args.collapse:
+        definite = {}
+        for version in versions:
+            definite[version] = [ targets[0] for kind, targets in version.relates(Global.depends)
+                                  if len(targets) == 1 and targets[0] in versions and targets[0] != version ]
+        components = find_components(versions, definite.__getitem__)
+        if args.reduce:
+            redundant = find_redundant_edges(components, definite.__getitem__)
+    labels = {} # first member of a collapsed component => label
+    node_ids = {} # member of a collapsed component => id of the component
+    if args.collapse:
+        for component in components:
+            if len(component) > 1:
+                component.sort(key=lambda v: (v.display_name(), v.id()))
+                names = [ member.display_name() for member in component ]
+                labels[component[0]] = ', '.join(names[:3]) + (' (+{})'.format(len(names) - 3) if len(names) > 3 else '')
+                for member in component:
+                    node_ids[member] = ':component:{}'.format(component[0].id())
+    node_id = lambda version: node_ids.get(version, version.id())
+    edge_ids = set() # edges already shown, which repeat with collapsed components
+
+    profiler.switch('output')
     write = lambda format, *args: sys.stdout.write(format.format(*args))
 
     def make_raw_node(id, **kwargs):
@@ -273,19 +553,26 @@ if __name__ == '__main__':
         }[kind]
         if versions[source] != versions[target]:
             style = 'bold'
-        make_raw_edge(source_id or source.id(), target.id(), label=kind, arrowhead=arrowhead, style=style, **kwargs)
+        if node_ids:
+            key = (source_id or node_id(source), node_id(target), kind)
+            if key in edge_ids:
+                return
+            edge_ids.add(key)
+        make_raw_edge(source_id or node_id(source), node_id(target), label=kind, arrowhead=arrowhead, style=style, **kwargs)
 
     def make_edges(source, kinds, color):
         for seq, (kind, targets) in enumerate(source.relates(kinds)):
-            filtered = [target for target in targets if target in versions and target != source]
+            filtered = [target for target in targets if target in versions and node_id(target) != node_id(source)]
             if not filtered:
                 pass
             elif len(targets) > 1:
                 fork_id = '{}:{}'.format(source.id(), seq)
                 make_raw_node(fork_id, label='', shape='point', fixedsize=True, width=0.1, height=0.1, color=color)
-                make_raw_edge(source.id(), fork_id, dir='none', len=0.3, color=color, style='bold')
+                make_raw_edge(node_id(source), fork_id, dir='none', len=0.3, color=color, style='bold')
                 for target in filtered:
                     make_edge(source, target, kind, source_id=fork_id, len=1.3, color=color)
+            elif kind in Global.depends and (source, filtered[0]) in redundant:
+                pass
             else:
                 make_edge(source, filtered[0], kind, color=color)
 
@@ -305,10 +592,38 @@ digraph "aptorphan" {
             'missing':('#f2f2f2', 'box', None),
             'spurious':('#f4cae4', 'box', None),
         }[kind]
-        make_raw_node(version.id(), label=version.display_name(), color=color, shape=shape)
+        if version not in node_ids:
+            make_raw_node(version.id(), label=version.display_name(), color=color, shape=shape)
+        elif version in labels:
+            make_raw_node(node_id(version), label=labels[version], color=color, shape=shape, peripheries=2)
         if version in config:
             for label in config[version]:
-                make_raw_edge(':config', version.id(), color='#b3e2cd', label=label)
+                if (':config', node_id(version), label) not in edge_ids:
+                    edge_ids.add((':config', node_id(version), label))
+                    make_raw_edge(':config', node_id(version), color='#b3e2cd', label=label)
         make_edges(version, depends, color)
+    if omitted:
+        make_raw_node(':omitted', label='{} more versions'.format(omitted), color='#ffffff', shape='note')
 
     write('{}\n', '}')
+    profiler.switch()
+
+    if args.debug:
+        for name, value in model.stats().items():
+            sys.stderr.write('debug: {}: {}\n'.format(name, value))
+    profiler.count(model.stats())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the difference between expected and installed packages as DOT graph.')
+    aptorphan_repository.add_arguments(parser)
+    add_arguments(parser)
+    aptorphan_profile.add_arguments(parser, ['open'] + PHASES, 'resolve')
+    args = parser.parse_args()
+    profiler = aptorphan_profile.from_arguments(args)
+    # Late initialization of repository, so that syntax errors in the
+    # configuration files can be reported immediately.
+    config = read_config(args)
+    profiler.switch('open')
+    repository = aptorphan_repository.from_arguments(args)
+    run(args, repository, profiler, config)
+    profiler.report()
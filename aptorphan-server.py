@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+
+# Keep the ranking in memory and answer queries on a Unix socket.
+#
+# Each request is a line with a command and a package name, and each
+# response is a line with a JSON object:
+#
+#     rank NAME      rank and hint of the candidate version
+#     why NAME       shortest dependency chain from a wishlist ('W') or
+#                    base ('D') version to the candidate version
+#     roots NAME     all wishlist and base versions pulling it in
+#     rdepends NAME  ranked versions depending on the candidate version
+#
+# For example: echo 'why libfoo1' | socat - UNIX-CONNECT:aptorphan.sock
+#
+# The APT and dpkg state files, the APT preferences and the
+# configuration files are polled, and the ranking is recreated in the
+# background when one of them has changed. Until then, the queries are
+# answered from the old ranking.
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+
+import apt_pkg
+
+import aptorphan
+import aptorphan_profile
+import aptorphan_repository
+import aptorphan_snapshot
+
+class Explorer(object):
+    # The indexes are built once per ranking, so that each query only
+    # follows a few references.
+    depends = {'Depends', 'PreDepends', 'Recommends'}
+    def __init__(self, repository, manager):
+        self.__repository = repository
+        self.__manager = manager
+        ranked = sorted(manager.ranked_versions(), key=lambda v: v.order)
+        edges = {}
+        self.__parents = {} # version => [(source, kind)]
+        for v in ranked:
+            edges[v] = [ (kind, targets) for kind, or_group, targets in manager.groups(v, self.depends) ]
+            for kind, targets in edges[v]:
+                for target in targets:
+                    self.__parents.setdefault(target, []).append((v, kind))
+        # Breadth-first search from all roots, so that the chains to
+        # all ranked versions are known in advance.
+        queue = collections.deque(v for v in ranked if v.hint in ('W', 'D'))
+        self.__previous = dict.fromkeys(queue) # version => (source, kind)
+        while queue:
+            v = queue.popleft()
+            for kind, targets in edges[v]:
+                for target in targets:
+                    if target.rank and target not in self.__previous:
+                        self.__previous[target] = (v, kind)
+                        queue.append(target)
+    def __find_version(self, name):
+        package = self.__repository.find_package_by_name(name)
+        if package is None:
+            raise Exception('unknown package: {}'.format(name))
+        if package.has_versions:
+            return self.__manager.wrapped_version(self.__repository.find_candidate_version(package))
+        if package.has_provides and len(package.provides_list) == 1:
+            return self.__manager.wrapped_version(package.provides_list[0][2])
+        raise Exception('package without versions: {}'.format(name))
+    def __describe(self, v, **kwargs):
+        return dict(package=v.underlying.parent_pkg.get_fullname(pretty=True), version=v.underlying.ver_str,
+                    rank=v.rank, hint=v.hint, **kwargs)
+    def rank(self, name):
+        return self.__describe(self.__find_version(name))
+    def why(self, name):
+        target = self.__find_version(name)
+        if target not in self.__previous:
+            return self.__describe(target, chain=None)
+        chain = []
+        v = target
+        while v is not None:
+            source, kind = self.__previous[v] or (None, None)
+            chain.append(self.__describe(v, kind=kind))
+            v = source
+        return self.__describe(target, chain=chain[::-1])
+    def roots(self, name):
+        v = self.__find_version(name)
+        seen = {v}
+        children = [v]
+        while children:
+            child = children.pop()
+            for parent, kind in self.__parents.get(child, ()):
+                if parent not in seen:
+                    seen.add(parent)
+                    children.append(parent)
+        roots = sorted((w for w in seen if w.hint in ('W', 'D')), key=lambda w: w.order)
+        return self.__describe(v, roots=list(map(self.__describe, roots)))
+    def rdepends(self, name):
+        v = self.__find_version(name)
+        return self.__describe(v, rdepends=[ self.__describe(source, kind=kind) for source, kind in self.__parents.get(v, ()) ])
+
+class Server(object):
+    def __init__(self, args, profiler):
+        self.__args = args
+        self.__profiler = profiler
+        files = [args.status, args.extended_states] + args.configs
+        self.__files = (aptorphan_snapshot.find_state_files(apt_pkg.config)
+                        + aptorphan_snapshot.find_preference_files(apt_pkg.config)
+                        + tuple(pathname for pathname in files if pathname))
+        self.__key = None
+        self.__explorer = None
+    def load(self):
+        # Runs in a thread, while the old ranking is still in use. If
+        # it fails, it is retried only after the next change.
+        self.__key = aptorphan_snapshot.make_key(self.__files, self.__key)
+        repository = aptorphan_repository.from_arguments(self.__args)
+        manager = aptorphan.Manager(repository, self.__profiler)
+        for package_name in aptorphan.read_wishlist(self.__args):
+            manager.rank_by_name(package_name, 'W')
+        manager.rank_unresolved()
+        manager.release()
+        self.__explorer = Explorer(repository, manager)
+    def is_outdated(self):
+        # Unlike a snapshot, the ranking has been created by this
+        # process. So a file, that is still missing, has not changed.
+        present = lambda key: { pathname: value for pathname, value in key.items() if value is not None }
+        key = aptorphan_snapshot.make_key(self.__files, self.__key)
+        return not aptorphan_snapshot.same_key(present(self.__key), present(key))
+    def query(self, line):
+        command, _, name = line.strip().partition(' ')
+        if command not in ('rank', 'why', 'roots', 'rdepends'):
+            raise Exception('unknown command: {}'.format(command))
+        return getattr(self.__explorer, command)(name.strip())
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self.query(line.decode())
+                except Exception as e:
+                    response = {'error': str(e)}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+    async def serve(self, pathname, interval):
+        loop = asyncio.get_running_loop()
+        server = await asyncio.start_unix_server(self.handle, path=pathname)
+        async with server:
+            while True:
+                await asyncio.sleep(interval)
+                if self.is_outdated():
+                    try:
+                        await loop.run_in_executor(None, self.load)
+                    except Exception as e:
+                        sys.stderr.write('reload failed: {}\n'.format(e))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answer queries about the ranking on a Unix socket.')
+    aptorphan_repository.add_arguments(parser)
+    parser.add_argument('--socket', metavar='PATH', required=True, help='location of the Unix socket')
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='seconds between checks for changed APT, dpkg and configuration files (default: %(default)s)')
+    aptorphan_profile.add_arguments(parser, ['open', 'candidates', 'base'], 'base')
+    parser.add_argument('configs', metavar='CONFIG', nargs='*')
+    args = parser.parse_args()
+    profiler = aptorphan_profile.from_arguments(args)
+    apt_pkg.init_config()
+    server = Server(args, profiler)
+    with profiler.phase('open'):
+        server.load()
+    profiler.report()
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    try:
+        asyncio.run(server.serve(args.socket, args.interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
@@ -1,61 +1,107 @@
 #! /usr/bin/env python3
 
+import argparse
+import io
+import multiprocessing
+import os
 import sys
 
 import apt_pkg
 import ast
+import heapq
+import json
 
-class Dict(dict):
-    def compute_if_absent(self, key, mapping):
-        try:
-            return self[key]
-        except KeyError:
-            return self.setdefault(key, mapping(key))
-
-class Repository(object):
-    def __init__(self):
-        apt_pkg.init()
-        cache = apt_pkg.Cache(progress=None)
-        depcache = apt_pkg.DepCache(cache)
-        self.find_packages = lambda: cache.packages
-        self.find_candidate_version = depcache.get_candidate_ver
-        self.find_package_by_name = lambda name: cache[name]
-        self.is_auto_installed = depcache.is_auto_installed
+import aptorphan_depends
+import aptorphan_incremental
+import aptorphan_names
+import aptorphan_profile
+import aptorphan_repository
+from aptorphan_repository import Dict, Repository
 
-class Wrapper(object):
+class Package(object):
+    __slots__ = ('id', 'underlying', 'candidate_version', 'rank', 'hint')
     def __init__(self, underlying):
-        self.underlying = underlying # XXX: make private
-    def __getattr__(self, name):
-        try:
-            return getattr(self.underlying, name)
-        except AttributeError:
-            value = self.__class__.defaults[name]()
-            setattr(self, name, value)
-            return value
+        self.id = underlying.id
+        self.underlying = underlying
+        self.candidate_version = None
+        self.rank = None
+        self.hint = None
+
+class Version(object):
+    # The sets and the list of conflicts contain the ids of related
+    # versions. Like the list of unresolved or-groups, they are only
+    # allocated when needed.
+    __slots__ = ('id', 'underlying', 'is_candidate_version', 'order', 'rank', 'hint',
+                 'unresolved', 'conflicts', 'notify', 'replaced_by')
+    def __init__(self, underlying, is_candidate_version, order):
+        self.id = underlying.id
+        self.underlying = underlying
+        self.is_candidate_version = is_candidate_version
+        self.order = order
+        self.rank = None
+        self.hint = None
+        self.unresolved = ()
+        self.conflicts = None
+        self.notify = None
+        self.replaced_by = None
 
-class Package(Wrapper):
-    defaults = {
-        'candidate_version': lambda: None,
-        'rank': lambda: None,
-        'hint': lambda: None,
-        }
+class TextWriter(object):
+    # The report entries refer to packages as tuples of (name, arch,
+    # display name, flags, hint, rank), and to or-groups as lists of
+    # (package, comparison, version).
+    def __init__(self, out):
+        self.__write = out.write
+    def __package(self, package, ranked=True):
+        name, arch, display_name, flags, hint, rank = package
+        items = '{}{}{}'.format(flags, hint or '', '' if rank is None else rank) if ranked else flags
+        return '{}[{}]'.format(display_name, items) if items else display_name
+    def __or_group(self, or_group, ranked=True):
+        return ' | '.join('{}{}{}'.format(self.__package(p, ranked), comp_type, target_ver) for p, comp_type, target_ver in or_group)
+    def unresolved(self, package, or_group, targets):
+        # The UNRESOLVED lines only show the flags of the packages.
+        self.__write('UNRESOLVED: {} => {} ({})\n'.format(
+                self.__package(package, False), self.__or_group(or_group, False),
+                ' | '.join(self.__package(target, False) for target in targets)))
+    def entry(self, action, package, explanations=()):
+        lines = ['{}: {}\n'.format(action, self.__package(package))]
+        for source, kind, or_group in explanations:
+            lines.append('  {} {}: {}\n'.format(self.__package(source), kind.lower(), self.__or_group(or_group)))
+        self.__write(''.join(lines))
+    def error(self, message):
+        self.__write('ERROR: {}\n'.format(message))
 
-class Version(Wrapper):
-    defaults = {
-        'is_candidate_version': lambda: False,
-        'rank': lambda: None,
-        'conflicts': lambda: set(),
-        'unresolved': lambda: [],
-        'notify': lambda: set(),
-        'replaced_by': lambda: set(),
-        }
+class JsonWriter(object):
+    # Writes one JSON object per line for each report entry. The
+    # fields are added to all objects, e.g. the name of the host.
+    def __init__(self, out, **fields):
+        self.__write = out.write
+        self.__encode = json.JSONEncoder(separators=(',', ':')).encode
+        self.__fields = fields
+    def __package(self, package):
+        name, arch, display_name, flags, hint, rank = package
+        return {'package': name, 'arch': arch, 'flags': flags, 'hint': hint, 'rank': rank}
+    def __or_group(self, or_group):
+        return [ dict(self.__package(p), comp_type=comp_type, target_ver=target_ver) for p, comp_type, target_ver in or_group ]
+    def __record(self, action, package, **kwargs):
+        self.__write(self.__encode(dict(self.__fields, action=action, **self.__package(package), **kwargs)) + '\n')
+    def unresolved(self, package, or_group, targets):
+        self.__record('unresolved', package, depends=self.__or_group(or_group), targets=list(map(self.__package, targets)))
+    def entry(self, action, package, explanations=()):
+        self.__record(action.lower(), package, explanations=[
+                {'source': self.__package(source), 'kind': kind.lower(), 'depends': self.__or_group(or_group)}
+                for source, kind, or_group in explanations])
+    def error(self, message):
+        self.__write(self.__encode(dict(self.__fields, action='error', error=message)) + '\n')
 
 class Manager(object):
-    def __init__(self, repository):
+    def __init__(self, repository, profiler=None, ranking=None, checkpoint=None):
+        profiler = profiler or aptorphan_profile.Profiler()
         self.__repository = repository
-        self.__foreign = frozenset(apt_pkg.get_architectures()[1:])
+        self.__profiler = profiler
+        self.__foreign = frozenset(repository.find_architectures()[1:])
         self.__packages = Dict()
         self.__versions = Dict()
+        self.__table = aptorphan_depends.DependencyTable(self.wrapped_version)
         self.__resolve = {
             'Conflicts': self.__resolve_conflicts,
             'Depends': self.__resolve_depends,
@@ -67,23 +113,67 @@ class Manager(object):
             'Replaces': self.__resolve_replaces,
             'Suggests': self.__resolve_ignore,
             }
+        self.__resolve_kinds = { kind for kind, resolve in self.__resolve.items() if resolve != self.__resolve_ignore }
         self.__ignore_forward = { 'Enhances', }
         self.__ignore_backward = { 'Depends', 'Recommends', 'Suggests', 'PreDepends', }
+        # Only the inspected kinds are expanded for the explanations, so
+        # that no versions are wrapped, that can not affect them.
+        self.__forward_kinds = set(self.__resolve) - self.__ignore_forward
+        self.__backward_kinds = set(self.__resolve) - self.__ignore_backward
         self.__rank = 0
-        # Initialize the candidate version for each package. The
-        # information is required in __find_base_versions, so it makes
-        # no sense to do it lazily.
-        for p in map(self.wrapped_package, self.__repository.find_packages()):
-            if p.has_versions:
-                v = self.wrapped_version(self.__repository.find_candidate_version(p.underlying))
-                p.candidate_version = v
-                v.is_candidate_version = True
-        # Automatically rank all base packages.
-        self.rank(self.__find_base_versions(), 'D')
+        self.__pushes = 0
+        self.__non_candidates = 0
+        self.__ranked = []
+        # The candidate versions are determined when a package or
+        # version is wrapped. The base versions are taken from an index
+        # built by the repository, so that only the part of the cache
+        # reachable from the ranked versions gets wrapped.
+        with profiler.phase('candidates'):
+            base = self.__find_base_versions()
+        # Automatically rank all base packages, unless the ranking of a
+        # previous run or the checkpoint of the base ranking is
+        # restored.
+        with profiler.phase('base'):
+            if ranking is not None:
+                self.__restore_ranking(ranking)
+            elif checkpoint is not None:
+                self.__restore_checkpoint(checkpoint)
+            else:
+                self.rank(base, 'D')
+    def stats(self):
+        return {
+            'versions wrapped': len(self.__versions),
+            'or-groups expanded': self.__table.stats['expanded'],
+            'expansions saved': self.__table.stats['saved'],
+            'rank_once rounds': self.__rank,
+            'pending pushes': self.__pushes,
+            }
+    def ranked_versions(self):
+        return [ v for v in self.__versions.values() if v.rank ]
+    def groups(self, version, kinds=None):
+        # Returns the or-groups of a wrapped version as (kind, or_group,
+        # targets) with the wrapped target versions.
+        return self.__table.groups(version.underlying, kinds)
     def wrapped_package(self, package):
-        return self.__packages.compute_if_absent(package.id, lambda id: Package(package))
+        return self.__packages.compute_if_absent(package.id, lambda id: self.__new_package(package))
     def wrapped_version(self, version):
-        return self.__versions.compute_if_absent(version.id, lambda id: Version(version))
+        return self.__versions.compute_if_absent(version.id, lambda id: self.__new_version(version))
+    def __new_package(self, package):
+        p = Package(package)
+        if package.has_versions:
+            candidate = self.__repository.find_candidate_version(package)
+            if candidate is not None:
+                p.candidate_version = self.wrapped_version(candidate)
+        return p
+    def __new_version(self, version):
+        candidate = self.__repository.find_candidate_version(version.parent_pkg)
+        # The order, in which rank_unresolved examines versions. It is
+        # the same as if the candidate versions of all packages had
+        # been wrapped up front in the order of the cache.
+        if candidate is not None and candidate.id == version.id:
+            return Version(version, True, (0, self.__repository.find_package_position(version.parent_pkg)))
+        self.__non_candidates += 1
+        return Version(version, False, (1, self.__non_candidates - 1))
     def __find_base_versions(self):
         # The set of base packages consists of all packages with a
         # priority of either REQUIRED, IMPORTANT or STANDARD. The
@@ -96,46 +186,135 @@ class Manager(object):
         # essential packages are REQUIRED or IMPORTANT (2) What
         # happens if there are several versions with different values.
         priorities = { apt_pkg.PRI_REQUIRED, apt_pkg.PRI_IMPORTANT, apt_pkg.PRI_STANDARD, }
-        for package in self.__packages.values():
-            if package.has_versions:
-                version = package.candidate_version
-                if version.priority not in priorities:
-                    pass # skip optional packages
-                elif version.arch in self.__foreign:
-                    pass # skip default packages of foreign architectures
-                else:
-                    yield version
-        raise StopIteration
+        result = []
+        for (priority, arch), versions in self.__repository.find_candidate_versions(priorities).items():
+            if arch in self.__foreign:
+                pass # skip default packages of foreign architectures
+            else:
+                result.extend(map(self.wrapped_version, versions))
+        return result
+    def export_ranking(self):
+        # The ranked versions are exported with their names and version
+        # strings, because the ids change whenever APT rebuilds its
+        # cache. The or-groups are identified by their position.
+        result = []
+        for v in [ v for v in self.__versions.values() if v.rank ]:
+            groups = self.__table.groups(v.underlying, self.__resolve_kinds) if v.unresolved else ()
+            result.append((
+                v.underlying.parent_pkg.get_fullname(), v.underlying.ver_str, v.rank, v.hint,
+                v.is_candidate_version, None if v.is_candidate_version else v.order,
+                [ groups.index(group) for group in v.unresolved ]))
+        return result
+    def __restore_ranking(self, ranking):
+        # Raises KeyError, if the ranking does not fit to the cache. In
+        # particular, the candidate versions may depend on the pinning
+        # and on versions only known from the dpkg status.
+        for name, ver_str, rank, hint, is_candidate_version, order, unresolved in ranking:
+            package = self.__repository.find_package_by_name(name)
+            version = package and next((v for v in package.version_list if v.ver_str == ver_str), None)
+            if version is None:
+                raise KeyError(name, ver_str)
+            v = self.wrapped_version(version)
+            if v.is_candidate_version != is_candidate_version:
+                raise KeyError(name, ver_str)
+            v.rank = rank
+            v.hint = hint
+            if order is not None:
+                v.order = order
+            if unresolved:
+                groups = self.__table.groups(version, self.__resolve_kinds)
+                v.unresolved = [ groups[i] for i in unresolved ]
+            self.__rank = max(self.__rank, rank)
+    def export_checkpoint(self):
+        # Unlike the ranking, the checkpoint contains the complete state
+        # of all wrapped versions, so that the ranking can be continued
+        # from it. Related versions are identified by their position in
+        # the checkpoint.
+        versions = list(self.__versions.values())
+        positions = { v.id: position for position, v in enumerate(versions) }
+        related = lambda ids: ids and sorted({ positions[id] for id in ids })
+        result = []
+        for v in versions:
+            groups = self.__table.groups(v.underlying, self.__resolve_kinds) if v.unresolved else ()
+            result.append((
+                v.underlying.parent_pkg.get_fullname(), v.underlying.ver_str,
+                v.is_candidate_version, None if v.is_candidate_version else v.order, v.rank, v.hint,
+                [ groups.index(group) for group in v.unresolved ],
+                related(v.conflicts), related(v.notify), related(v.replaced_by)))
+        return self.__rank, self.__non_candidates, result
+    def __restore_checkpoint(self, checkpoint):
+        # Raises KeyError like __restore_ranking. All versions are
+        # wrapped first, so that the or-groups refer to the restored
+        # versions.
+        rank, non_candidates, entries = checkpoint
+        versions = []
+        for name, ver_str, is_candidate_version, order, *_ in entries:
+            package = self.__repository.find_package_by_name(name)
+            version = package and next((v for v in package.version_list if v.ver_str == ver_str), None)
+            if version is None:
+                raise KeyError(name, ver_str)
+            v = self.wrapped_version(version)
+            if v.is_candidate_version != is_candidate_version:
+                raise KeyError(name, ver_str)
+            if order is not None:
+                v.order = order
+            versions.append(v)
+        self.__non_candidates = non_candidates
+        related = lambda positions: positions and { versions[position].id for position in positions } or None
+        for v, entry in zip(versions, entries):
+            v.rank, v.hint, unresolved, conflicts, notify, replaced_by = entry[4:]
+            if unresolved:
+                groups = self.__table.groups(v.underlying, self.__resolve_kinds)
+                v.unresolved = [ groups[i] for i in unresolved ]
+            v.conflicts = conflicts and [ versions[position].id for position in conflicts ] or None
+            v.notify, v.replaced_by = related(notify), related(replaced_by)
+            if v.rank:
+                self.__ranked.append(v)
+        self.__rank = rank
     def rank_by_name(self, package_name, hint):
+        if aptorphan_names.is_pattern(package_name):
+            return self.rank_by_pattern(package_name, hint)
         package = self.__repository.find_package_by_name(package_name)
+        if package is None:
+            raise Exception('unknown package: {}'.format(package_name))
         if package.has_versions:
             self.rank([ self.wrapped_version(self.__repository.find_candidate_version(package)) ], hint)
         elif package.has_provides and len(package.provides_list) == 1:
             self.rank([ self.wrapped_version(package.provides_list[0][2]) ], hint)
         else:
             raise Exception('can not rank package without versions: {}'.format(package_name))
+    def rank_by_pattern(self, pattern, hint):
+        # All matching packages are ranked together.
+        packages = self.__repository.find_packages_by_pattern(pattern)
+        versions = [ self.wrapped_version(v) for v in map(self.__repository.find_candidate_version, packages) if v is not None ]
+        if not versions:
+            raise Exception('no package matches: {}'.format(pattern))
+        self.rank(versions, hint)
     def rank(self, versions, hint):
         while versions:
-            versions = sorted(versions, key=lambda v: v.parent_pkg.name)
+            versions = sorted(versions, key=lambda v: v.underlying.parent_pkg.name)
             versions = self.rank_once(versions, hint)
             hint = None
     def rank_once(self, versions, hint):
         self.__rank += 1
-        self.__pending_depends = set(versions)
+        self.__pending_depends = { v.id for v in versions }
+        self.__pushes += len(versions)
         for v in versions:
             if v.rank is None:
                 v.rank = self.__rank
                 v.hint = hint
-                for kind, and_group in v.depends_list.items():
-                    for or_group in and_group:
-                        self.__resolve[kind](v, or_group)
-                self.__pending_depends.update(v.notify)
+                self.__ranked.append(v)
+                for group in self.__table.groups(v.underlying, self.__resolve_kinds):
+                    self.__resolve[group[0]](v, group)
+                if v.notify:
+                    self.__pending_depends.update(v.notify)
+                    self.__pushes += len(v.notify)
         result = set()
         while self.__pending_depends:
-            v = self.__pending_depends.pop()
+            v = self.__versions[self.__pending_depends.pop()]
             i = 0
             while i < len(v.unresolved):
-                targets = self.__expand_or_group(v.unresolved[i])
+                targets = v.unresolved[i][2]
                 candidate = self.__resolve_once(targets, False)
                 if any(target.rank for target in targets):
                     # already resolved and nothing more to do
@@ -155,146 +334,424 @@ class Manager(object):
         if len(candidates) == 1 or (len(candidates) > 1 and auto_select_designated):
             return candidates[0]
         return None
-    def __resolve_depends(self, version, or_group):
-        version.unresolved.append(or_group)
-        for target in self.__expand_or_group(or_group):
-            target.notify.add(version)
-    def __resolve_conflicts(self, version, or_group):
+    def __resolve_depends(self, version, group):
+        if not version.unresolved:
+            version.unresolved = []
+        version.unresolved.append(group)
+        for target in group[2]:
+            if target.notify is None:
+                target.notify = set()
+            target.notify.add(version.id)
+    def __resolve_conflicts(self, version, group):
+        kind, or_group, targets = group
         if len(or_group) != 1:
-            raise Exception('unexpected conflicts: {} {}'.format(version.parent_pkg.get_fullname(), or_group))
-        for target in self.__expand_or_group(or_group):
-            version.conflicts.add(target)
-            target.conflicts.add(version)
-            for subject in target.notify:
-                if subject.unresolved:
-                    self.__pending_depends.add(subject)
-    def __resolve_replaces(self, version, or_group):
+            raise Exception('unexpected conflicts: {} {}'.format(version.underlying.parent_pkg.get_fullname(), or_group))
+        for target in targets:
+            if version.conflicts is None:
+                version.conflicts = []
+            version.conflicts.append(target.id)
+            # __resolve_once only checks, whether a target has any
+            # conflicts. So the or-groups have to be examined again
+            # only if an unranked target gets its first conflict. The
+            # version itself has already been ranked.
+            if target.conflicts is None:
+                target.conflicts = []
+                if target.rank is None:
+                    for subject in target.notify or ():
+                        if self.__versions[subject].unresolved:
+                            self.__pending_depends.add(subject)
+                            self.__pushes += 1
+            target.conflicts.append(version.id)
+    def __resolve_replaces(self, version, group):
+        kind, or_group, targets = group
         if len(or_group) != 1:
-            raise Exception('unexpected replaces: {} {}'.format(version.parent_pkg.get_fullname(), or_group))
-        for target in self.__expand_or_group(or_group):
-            target.replaced_by.add(version)
-    def __resolve_ignore(self, version, or_group):
+            raise Exception('unexpected replaces: {} {}'.format(version.underlying.parent_pkg.get_fullname(), or_group))
+        for target in targets:
+            if target.replaced_by is None:
+                target.replaced_by = set()
+            target.replaced_by.add(version.id)
+    def __resolve_ignore(self, version, group):
         pass
-    def __expand_or_group(self, or_group):
-        # keep the original order
-        result = []
-        seen = set()
-        for dependency in or_group:
-            for target in map(self.wrapped_version, dependency.all_targets()):
-                if target not in seen:
-                    result.append(target)
-                    seen.add(target)
-        return result
-    def __format_or_group(self, or_group):
-        def make(dep):
-            p = self.__format_package(self.wrapped_package(dep.target_pkg))
-            return '{}{}{}'.format(p, dep.comp_type, dep.target_ver)
-        return ' | '.join(map(make, or_group))
+    def __describe_or_group(self, or_group):
+        return [ (self.__describe_package(self.wrapped_package(dep.target_pkg)), dep.comp_type, dep.target_ver)
+                 for dep in or_group ]
     def __is_installed_package(self, package):
-        return (package.current_state != apt_pkg.CURSTATE_NOT_INSTALLED
-                and package.selected_state != apt_pkg.SELSTATE_UNKNOWN)
+        return (self.__repository.find_current_state(package.underlying) != apt_pkg.CURSTATE_NOT_INSTALLED
+                and self.__repository.find_selected_state(package.underlying) != apt_pkg.SELSTATE_UNKNOWN)
+    def __is_outdated_package(self, package):
+        # The installed version of another host might be unknown.
+        current = self.__repository.find_current_version(package.underlying)
+        return current is None or current.id != package.candidate_version.id
     def __is_interessting_package(self, package):
         return package.rank is not None or self.__is_installed_package(package)
     def __is_interessting_version(self, version):
-        return version.is_candidate_version and self.__is_interessting_package(self.wrapped_package(version.parent_pkg))
+        return version.is_candidate_version and self.__is_interessting_package(self.wrapped_package(version.underlying.parent_pkg))
+    def __take_ranked(self):
+        self.__ranked, result = [], self.__ranked
+        return result
     def rank_unresolved(self):
-        resolved = True
-        while resolved:
-            resolved = False
-            for v in list(self.__versions.values()):
-                if v.rank and v.unresolved:
-                    for or_group in list(v.unresolved):
-                        targets = self.__expand_or_group(or_group)
-                        candidate = self.__resolve_once(targets, True)
-                        if not any(target.rank for target in targets) and candidate is not None:
-                            self.rank([ candidate ], 'C')
-                            resolved = True
-    def dump_unresolved(self):
-        for v in self.__versions.values():
-            if v.rank and v.unresolved:
-                for or_group in v.unresolved:
-                    make = self.__format_version
-                    print('UNRESOLVED: {} => {} ({})'.format(
-                            make(v),
-                            self.__format_or_group(or_group),
-                            ' | '.join(map(make, self.__expand_or_group(or_group)))))
+        # The result is the same as scanning all versions in the order
+        # of self.__versions again and again, until a scan ranks no
+        # more versions. However, once a ranked version has been
+        # examined, none of its remaining or-groups can ever be
+        # resolved: ranks are never reset, and the candidate versions
+        # are fixed. Conflicts only affect which candidate is chosen,
+        # and that is decided when the version is examined. So each
+        # version has to be examined exactly once after it has been
+        # ranked, in the same scan the full rescan would examine it.
+        pending = self.__take_ranked()
+        while pending:
+            limit = self.__non_candidates
+            heap = [ (v.order, v) for v in pending ]
+            heapq.heapify(heap)
+            pending = []
+            while heap:
+                order, v = heapq.heappop(heap)
+                for kind, or_group, targets in list(v.unresolved):
+                    candidate = self.__resolve_once(targets, True)
+                    if not any(target.rank for target in targets) and candidate is not None:
+                        self.rank([ candidate ], 'C')
+                        for w in self.__take_ranked():
+                            if order < w.order and (w.order[0] == 0 or w.order[1] < limit):
+                                heapq.heappush(heap, (w.order, w)) # still part of this scan
+                            else:
+                                pending.append(w) # part of the next scan
+    def release(self):
+        # The sets of related versions are only required for the
+        # ranking. Releasing them when the ranking is complete keeps the
+        # memory for the report small. The ranking can not be continued
+        # afterwards.
         for v in self.__versions.values():
-            p = self.wrapped_package(v.parent_pkg)
-            if v.rank is None:
-                pass # nothing
-            elif p.rank is None:
+            v.conflicts = v.notify = v.replaced_by = None
+        # The unranked versions can not affect the result. Their
+        # wrappers and the underlying objects are dropped together with
+        # the expanded or-groups referring to them, and they are only
+        # wrapped again if the report inspects them. The or-groups of
+        # versions with unresolved or-groups are kept, because the
+        # ranking is exported by their position.
+        keep = { v.id for v in self.__versions.values() if v.rank }
+        keep.update(self.__table.retain({ v.id for v in self.__versions.values() if v.unresolved }))
+        self.__versions = Dict((id, v) for id, v in self.__versions.items() if id in keep)
+        self.__packages = Dict((id, p) for id, p in self.__packages.items()
+                               if p.candidate_version is None or p.candidate_version.id in keep)
+    def dump_unresolved(self, explanations=None, changed=None, writer=None):
+        # The explanations of a previous run are reused for all
+        # packages, whose entries can not be affected by the packages
+        # with a changed installed state (given by name, or None if
+        # unknown). The explanations of this run are returned.
+        writer = writer or TextWriter(sys.stdout)
+        if explanations is not None and changed is not None:
+            changed = self.__find_affected(changed)
+        self.__explanations = None if explanations is None else ({}, explanations, changed)
+        self.__reverse = None
+        self.__forward = {}
+        ranked = sorted((v for v in self.__versions.values() if v.rank), key=lambda v: v.order)
+        for v in ranked:
+            p = self.wrapped_package(v.underlying.parent_pkg)
+            if p.rank is None:
                 p.rank = v.rank
                 p.hint = v.hint
             else:
-                raise Exception('unexpected ranked versions: {}'.format(p.get_fullname()))
+                raise Exception('unexpected ranked versions: {}'.format(p.underlying.get_fullname()))
+        for v in ranked:
+            if v.unresolved:
+                for kind, or_group, targets in v.unresolved:
+                    make = self.__describe_version
+                    writer.unresolved(make(v), self.__describe_or_group(or_group), list(map(make, targets)))
         # The remaining packages are sorted by the field
         # AUTO_INSTALLED. This order is usually good enough to spot,
         # which packages should be actually removed from the system.
+        #
+        # Only ranked and installed packages are relevant. Packages,
+        # which have not been wrapped so far, are not ranked.
+        current_state = self.__repository.find_current_state
+        self.__reported = [ self.wrapped_package(p) for p in self.__repository.find_packages()
+                            if p.id in self.__packages or current_state(p) != apt_pkg.CURSTATE_NOT_INSTALLED ]
         removes = []
-        for p in self.__packages.values():
+        for p in self.__reported:
             if p.rank is None:
-                if p.current_state != apt_pkg.CURSTATE_NOT_INSTALLED:
+                if current_state(p.underlying) != apt_pkg.CURSTATE_NOT_INSTALLED:
                     score = self.__repository.is_auto_installed(p.underlying)
                     removes.append((p, score))
-            elif (p.current_state != apt_pkg.CURSTATE_INSTALLED
-                  and p.selected_state != apt_pkg.SELSTATE_INSTALL):
-                print('INSTALL:', self.__format_package(p))
-                self.__dump_dependencies(p)
-            elif p.current_ver.id != p.candidate_version.id:
-                print('UPGRADE:', self.__format_package(p))
-                self.__dump_dependencies(p)
+            elif (current_state(p.underlying) != apt_pkg.CURSTATE_INSTALLED
+                  and self.__repository.find_selected_state(p.underlying) != apt_pkg.SELSTATE_INSTALL):
+                writer.entry('INSTALL', self.__describe_package(p), self.__dump_dependencies(p))
+            elif self.__is_outdated_package(p):
+                writer.entry('UPGRADE', self.__describe_package(p), self.__dump_dependencies(p))
             elif self.__repository.is_auto_installed(p.underlying) == (p.hint == 'W'):
-                print('WISHLIST:', self.__format_package(p))
-        for p, score in sorted(removes, key=lambda t: (t[1], t[0].name)):
-            print('REMOVE:', self.__format_package(p))
-            self.__dump_dependencies(p)
+                writer.entry('WISHLIST', self.__describe_package(p))
+        for p, score in sorted(removes, key=lambda t: (t[1], t[0].underlying.name)):
+            writer.entry('REMOVE', self.__describe_package(p), self.__dump_dependencies(p))
+        return self.__explanations and self.__explanations[0]
+    def __find_affected(self, changed):
+        # A changed package is also added to the explanations of the
+        # targets of its dependencies. Those only watch the packages,
+        # that have been in the cache before, and not e.g. a package
+        # installed with dpkg -i.
+        result = set(changed)
+        for name in changed:
+            p = self.__repository.find_package_by_name(name)
+            v = p and p.has_versions and self.__repository.find_candidate_version(p)
+            if v:
+                for kind, or_group, targets in self.__table.groups(v, self.__forward_kinds):
+                    result.update(dependency.target_pkg.get_fullname() for dependency in or_group)
+                    result.update(t.underlying.parent_pkg.get_fullname() for t in targets)
+        return result
     def __dump_dependencies(self, package):
+        if self.__explanations is None:
+            return self.__explain(package, None)
+        else:
+            current, previous, changed = self.__explanations
+            name = package.underlying.get_fullname()
+            entry = previous.get(name)
+            if entry is None or changed is None or name in changed or not entry[1].isdisjoint(changed):
+                watched = set()
+                entry = (self.__explain(package, watched), frozenset(watched))
+            current[name] = entry
+            return entry[0]
+    def __explain(self, package, watched):
+        # Optionally collects the names of all packages, whose installed
+        # state may change the explanations.
         v = package.candidate_version
-        for reverse in filter(self.__is_interessting_package, { self.wrapped_package(dependency.parent_pkg) for dependency in package.rev_depends_list }):
-            self.__dump_dependencies_forward(reverse.candidate_version, v)
-        self.__dump_dependencies_backward(v)
-    def __dump_dependencies_forward(self, source, target):
-        for kind, and_group in source.depends_list.items():
-            if kind not in self.__ignore_forward:
-                for or_group in and_group:
-                    if target in self.__expand_or_group(or_group):
-                        print('  {} {}: {}'.format(self.__format_version(source), kind.lower(), self.__format_or_group(or_group)))
-    def __dump_dependencies_backward(self, version):
-        for kind, and_group in version.depends_list.items():
+        result = []
+        reverse = { dependency.parent_pkg.id: dependency.parent_pkg for dependency in package.underlying.rev_depends_list }
+        if watched is not None:
+            watched.update(p.get_fullname() for p in reverse.values())
+        for source, kind, or_group in self.__find_reverse_dependencies(v, reverse.values()):
+            result.append((self.__describe_version(source), kind, self.__describe_or_group(or_group)))
+            if watched is not None:
+                watched.update(dependency.target_pkg.get_fullname() for dependency in or_group)
+        for kind, or_group, targets in self.__table.groups(v.underlying, self.__backward_kinds):
             if kind not in self.__ignore_backward:
-                for or_group in and_group:
-                    if any(map(self.__is_interessting_version, self.__expand_or_group(or_group))):
-                        print('  {} {}: {}'.format(self.__format_version(version), kind.lower(), self.__format_or_group(or_group)))
-    def __format_package(self, package):
-        items = []
-        if self.__repository.is_auto_installed(package.underlying):
-            items.append('M')
-        if package.current_state == apt_pkg.CURSTATE_CONFIG_FILES:
-            items.append('c')
-        elif package.current_state != apt_pkg.CURSTATE_NOT_INSTALLED:
-            items.append('i')
-        if package.has_provides and not package.has_versions:
-            items.append('v')
-        if package.hint is not None:
-            items.append(package.hint)
-        if package.rank is not None:
-            items.append(package.rank)
-        items = ''.join(map(str, items))
-        if items:
-            return '{}[{}]'.format(package.get_fullname(pretty=True), items)
+                if watched is not None:
+                    watched.update(t.underlying.parent_pkg.get_fullname() for t in targets)
+                if any(map(self.__is_interessting_version, targets)):
+                    result.append((self.__describe_version(v), kind, self.__describe_or_group(or_group)))
+                    if watched is not None:
+                        watched.update(dependency.target_pkg.get_fullname() for dependency in or_group)
+        return result
+    def __find_reverse_dependencies(self, target, parents):
+        # Yields the or-groups of the interesting candidate versions of
+        # the parents, that contain the target, in the order of the
+        # cache. Interesting packages have been wrapped by
+        # dump_unresolved. A full run explains all packages, and the
+        # index over all interesting packages is built once. An
+        # incremental run only explains a few packages, and only the
+        # packages depending on the target are examined.
+        position = self.__repository.find_package_position
+        if self.__explanations is None or self.__explanations[2] is None:
+            if self.__reverse is None:
+                # The entries are stored flat as source and or-group,
+                # because the index has an entry for each edge.
+                self.__reverse = {}
+                interesting = [ p for p in self.__packages.values() if self.__forward_groups(p) ]
+                for p in sorted(interesting, key=lambda p: position(p.underlying)):
+                    for group in self.__forward_groups(p):
+                        for t in group[2]:
+                            self.__reverse.setdefault(t, []).extend((p.candidate_version, group))
+            ids = { parent.id for parent in parents }
+            entries = self.__reverse.get(target, ())
+            for source, (kind, or_group, targets) in zip(entries[0::2], entries[1::2]):
+                if source.underlying.parent_pkg.id in ids:
+                    yield source, kind, or_group
         else:
-            return package.get_fullname(pretty=True)
-    def __format_version(self, version):
-        return self.__format_package(self.wrapped_package(version.parent_pkg))
+            for parent in sorted(parents, key=position):
+                p = self.__packages.get(parent.id)
+                if p is not None:
+                    for kind, or_group, targets in self.__forward_groups(p):
+                        if target in targets:
+                            yield p.candidate_version, kind, or_group
+    def __forward_groups(self, package):
+        # The or-groups of the candidate version of an interesting
+        # package, that are followed forward by the explanations. The
+        # tuples are shared with the dependency table.
+        try:
+            return self.__forward[package.underlying.id]
+        except KeyError:
+            pass # unwind exception stack
+        result = ()
+        if package.candidate_version is not None and self.__is_interessting_package(package):
+            result = self.__table.groups(package.candidate_version.underlying, self.__forward_kinds)
+        return self.__forward.setdefault(package.underlying.id, result)
+    def __describe_package(self, package):
+        underlying = package.underlying
+        flags = []
+        if self.__repository.is_auto_installed(underlying):
+            flags.append('M')
+        current_state = self.__repository.find_current_state(underlying)
+        if current_state == apt_pkg.CURSTATE_CONFIG_FILES:
+            flags.append('c')
+        elif current_state != apt_pkg.CURSTATE_NOT_INSTALLED:
+            flags.append('i')
+        if underlying.has_provides and not underlying.has_versions:
+            flags.append('v')
+        return (underlying.name, underlying.architecture, underlying.get_fullname(pretty=True),
+                ''.join(flags), package.hint, package.rank)
+    def __describe_version(self, version):
+        return self.__describe_package(self.wrapped_package(version.underlying.parent_pkg))
 
-if __name__ == '__main__':
+PHASES = ['candidates', 'base', 'wishlist', 'unresolved', 'output', 'save', 'profiles']
+
+def add_arguments(parser):
+    parser.add_argument('--incremental', action='store_true',
+                        help='reuse the ranking and the explanations of the previous run as long as the archive and the configuration are unchanged')
+    parser.add_argument('--incremental-file', metavar='PATH',
+                        help='location of the state (implies --incremental, default: next to the cache)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='reuse the ranking of the base packages as long as the archive is unchanged')
+    parser.add_argument('--checkpoint-file', metavar='PATH',
+                        help='location of the checkpoint (implies --checkpoint, default: next to the cache)')
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help='print the report as text or as one JSON object per line (default: %(default)s)')
+    parser.add_argument('--multi', action='store_true',
+                        help='treat each configuration file as a separate profile and print one report per profile')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes for --multi (default: %(default)s)')
+    parser.add_argument('--debug', action='store_true', help='print statistics to stderr')
+    parser.add_argument('configs', metavar='CONFIG', nargs='*')
+
+def read_wishlist(args):
     parse = lambda text: ast.literal_eval(text)
     wishlist = []
-    for pathname in sys.argv[1:]:
+    for pathname in args.configs:
         with open(pathname, 'r') as f:
             wishlist.extend(parse(f.read()))
-    manager = Manager(Repository())
-    for package_name in wishlist:
-        manager.rank_by_name(package_name, 'W')
-    manager.rank_unresolved()
-    manager.dump_unresolved()
+    return wishlist
+
+def create_manager(args, repository, profiler):
+    # Returns a manager with the ranked base packages. With a valid
+    # checkpoint, the ranking is restored instead of computed.
+    if not (args.checkpoint or args.checkpoint_file):
+        return Manager(repository, profiler)
+    pathname = args.checkpoint_file or aptorphan_incremental.default_pathname(apt_pkg.config, 'aptorphan.checkpoint')
+    files = aptorphan_incremental.find_state_files(apt_pkg.config)
+    checkpoint, key = aptorphan_incremental.load(pathname, files, ())
+    # Without the files of the key, it can not be told whether the
+    # archive has changed, and the checkpoint is neither used nor saved.
+    complete = aptorphan_incremental.is_complete(key)
+    if checkpoint is not None and complete:
+        try:
+            return Manager(repository, profiler, checkpoint=checkpoint)
+        except KeyError:
+            pass
+    manager = Manager(repository, profiler)
+    if complete:
+        with profiler.phase('save'):
+            aptorphan_incremental.save(pathname, key, (), manager.export_checkpoint())
+    return manager
+
+_manager = None # base-ranked state inherited by the forked workers
+
+def _report_profile(profile):
+    # Runs in a worker process, so that the ranking of one profile does
+    # not leak into the other profiles. Returns the report and whether
+    # it failed.
+    name, wishlist, format = profile
+    output = io.StringIO()
+    if format == 'jsonl':
+        writer = JsonWriter(output, profile=name)
+    else:
+        writer = TextWriter(output)
+        output.write('PROFILE: {}\n'.format(name))
+    try:
+        for package_name in wishlist:
+            _manager.rank_by_name(package_name, 'W')
+        _manager.rank_unresolved()
+        _manager.dump_unresolved(writer=writer)
+    except Exception as e:
+        writer.error(str(e))
+        return output.getvalue(), True
+    return output.getvalue(), False
+
+def run_profiles(args, repository, profiler):
+    # The base ranking only depends on the archive. It is done once,
+    # and the profiles are ranked in worker processes forked from it.
+    # The profiles are named by the given paths. Returns the number of
+    # failed profiles.
+    global _manager
+    if len(set(args.configs)) != len(args.configs):
+        raise Exception('duplicate profiles: {}'.format(' '.join(sorted({ c for c in args.configs if args.configs.count(c) > 1 }))))
+    profiles = []
+    for pathname in args.configs:
+        with open(pathname, 'r') as f:
+            profiles.append((pathname, ast.literal_eval(f.read()), args.format))
+    _manager = create_manager(args, repository, profiler)
+    failed = 0
+    with profiler.phase('profiles'):
+        # Ranking a profile and creating its report modify the
+        # inherited manager, so each worker is used for one profile
+        # only and a fresh one is forked from the base ranking for the
+        # next.
+        with multiprocessing.get_context('fork').Pool(args.jobs, maxtasksperchild=1) as pool:
+            for report, error in pool.imap(_report_profile, profiles):
+                sys.stdout.write(report)
+                failed += error
+    profiler.count(_manager.stats())
+    return failed
+
+def run(args, repository, profiler, wishlist=None):
+    if args.multi:
+        if args.incremental or args.incremental_file:
+            raise Exception('--multi can not be combined with --incremental')
+        return run_profiles(args, repository, profiler)
+    if wishlist is None:
+        wishlist = read_wishlist(args)
+    # In incremental mode, the ranking of the previous run is reused,
+    # and only the explanations of packages related to packages with a
+    # changed installed state are created again.
+    state = None
+    if args.incremental or args.incremental_file:
+        pathname = args.incremental_file or aptorphan_incremental.default_pathname(apt_pkg.config)
+        files = aptorphan_incremental.find_state_files(apt_pkg.config)
+        state, key = aptorphan_incremental.load(pathname, files, tuple(wishlist))
+    manager = None
+    if state is not None:
+        try:
+            manager = Manager(repository, profiler, state['ranking'])
+        except KeyError:
+            state = None
+    if manager is None:
+        manager = create_manager(args, repository, profiler)
+        with profiler.phase('wishlist'):
+            for package_name in wishlist:
+                manager.rank_by_name(package_name, 'W')
+        with profiler.phase('unresolved'):
+            manager.rank_unresolved()
+            manager.release()
+    with profiler.phase('output'):
+        writer = { 'text': TextWriter, 'jsonl': JsonWriter }[args.format](sys.stdout)
+        if args.incremental or args.incremental_file:
+            installed = repository.find_installed_states()
+            if state is None:
+                explanations = manager.dump_unresolved({}, None, writer)
+            else:
+                previous = state['installed']
+                changed = { name for name in installed.keys() | previous.keys() if installed.get(name) != previous.get(name) }
+                explanations = manager.dump_unresolved(state['explanations'], changed, writer)
+        else:
+            manager.dump_unresolved(writer=writer)
+    if (args.incremental or args.incremental_file) and aptorphan_incremental.is_complete(key):
+        with profiler.phase('save'):
+            aptorphan_incremental.save(pathname, key, tuple(wishlist), {
+                'ranking': manager.export_ranking(),
+                'installed': installed,
+                'explanations': explanations,
+                })
+    if args.debug:
+        for name, value in manager.stats().items():
+            sys.stderr.write('debug: {}: {}\n'.format(name, value))
+    profiler.count(manager.stats())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show packages, which should be installed or removed.')
+    aptorphan_repository.add_arguments(parser)
+    add_arguments(parser)
+    aptorphan_profile.add_arguments(parser, ['open'] + PHASES, 'unresolved')
+    args = parser.parse_args()
+    profiler = aptorphan_profile.from_arguments(args)
+    wishlist = read_wishlist(args)
+    with profiler.phase('open'):
+        repository = aptorphan_repository.from_arguments(args)
+    failed = run(args, repository, profiler, wishlist)
+    profiler.report()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,45 @@
+# Dependency table shared by the scripts.
+#
+# Expanding an or-group requires a call to all_targets() for each
+# alternative, which is expensive with apt_pkg. The table expands each
+# or-group at most once per run and keeps the result as a tuple of
+# wrapped target versions. The or-groups are expanded lazily per kind,
+# because for most versions only some kinds are ever inspected.
+
+class DependencyTable(object):
+    def __init__(self, wrap):
+        self.__wrap = wrap
+        self.__rows = {}
+        self.stats = {'expanded': 0, 'saved': 0}
+    def groups(self, version, kinds=None):
+        # Returns a list of (kind, or_group, targets) in the order of
+        # the underlying depends_list.
+        try:
+            row = self.__rows[version.id]
+        except KeyError:
+            row = self.__rows[version.id] = [[kind, and_group, None] for kind, and_group in version.depends_list.items()]
+        result = []
+        for item in row:
+            if kinds is None or item[0] in kinds:
+                if item[2] is None:
+                    item[2] = tuple((item[0], or_group, self.__expand_or_group(or_group)) for or_group in item[1])
+                    self.stats['expanded'] += len(item[2])
+                else:
+                    self.stats['saved'] += len(item[2])
+                result.extend(item[2])
+        return result
+    def retain(self, ids):
+        # Drops the rows of all other versions and returns the ids of
+        # the targets of the remaining rows.
+        self.__rows = { id: row for id, row in self.__rows.items() if id in ids }
+        return { t.id for row in self.__rows.values() for item in row if item[2] for group in item[2] for t in group[2] }
+    def __expand_or_group(self, or_group):
+        # keep the original order
+        result = []
+        seen = set()
+        for dependency in or_group:
+            for target in map(self.__wrap, dependency.all_targets()):
+                if target not in seen:
+                    result.append(target)
+                    seen.add(target)
+        return tuple(result)
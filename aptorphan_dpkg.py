@@ -0,0 +1,127 @@
+# Installed state of a host, read from the dpkg status file and the
+# extended_states file of APT.
+#
+# The state can replace the installed state of the local system in a
+# Repository, so that a single APT cache can be compared against the
+# state collected from other hosts. Packages are identified by name
+# and architecture, and the installed version by its version string.
+
+import itertools
+import mmap
+import os
+import re
+
+class InstalledState(object):
+    def __init__(self, packages, auto, unknown):
+        self.__packages = packages # (name, arch) => (current_state, selected_state, ver_str)
+        self.__auto = auto # set of (name, arch)
+        self.__unknown = unknown # record for packages missing in the status file
+        self.__versions = {}
+    def __find(self, package):
+        return self.__packages.get((package.name, package.architecture), self.__unknown)
+    def current_state(self, package):
+        return self.__find(package)[0]
+    def selected_state(self, package):
+        return self.__find(package)[1]
+    def current_version(self, package):
+        # The version is None, if the host has a version installed,
+        # which is not part of the cache.
+        try:
+            return self.__versions[package.id]
+        except KeyError:
+            pass # unwind exception stack
+        ver_str = self.__find(package)[2]
+        result = None
+        if ver_str is not None:
+            result = next((v for v in package.version_list if v.ver_str == ver_str), None)
+        return self.__versions.setdefault(package.id, result)
+    def is_auto_installed(self, package):
+        return (package.name, package.architecture) in self.__auto
+
+def _current_states(apt_pkg):
+    return {
+        'not-installed': apt_pkg.CURSTATE_NOT_INSTALLED,
+        'config-files': apt_pkg.CURSTATE_CONFIG_FILES,
+        'half-installed': apt_pkg.CURSTATE_HALF_INSTALLED,
+        'unpacked': apt_pkg.CURSTATE_UNPACKED,
+        'half-configured': apt_pkg.CURSTATE_HALF_CONFIGURED,
+        # not exported by python-apt, the values of pkgCache::State
+        'triggers-awaited': getattr(apt_pkg, 'CURSTATE_TRIGGERS_AWAITED', 7),
+        'triggers-pending': getattr(apt_pkg, 'CURSTATE_TRIGGERS_PENDING', 8),
+        'installed': apt_pkg.CURSTATE_INSTALLED,
+        }
+
+def _selected_states(apt_pkg):
+    return {
+        'unknown': apt_pkg.SELSTATE_UNKNOWN,
+        'install': apt_pkg.SELSTATE_INSTALL,
+        'hold': apt_pkg.SELSTATE_HOLD,
+        'deinstall': apt_pkg.SELSTATE_DEINSTALL,
+        'purge': apt_pkg.SELSTATE_PURGE,
+        }
+
+def scan(pathname, fields):
+    # Yields a tuple with the values of the given fields for each
+    # stanza. The file is memory-mapped and only the lines starting
+    # with one of the fields are matched, so that the large fields
+    # like Description and Conffiles are skipped by the regular
+    # expression. The matches are consumed one by one, so that the
+    # memory does not grow with the size of the file. A stanza starts
+    # with the first field, which has to be Package, as written by
+    # dpkg and APT. Continuation lines are folded into the value.
+    field = b'(' + b'|'.join(re.escape(name.encode()) for name in fields) + b'):([^\n]*(?:\n[ \t][^\n]*)*)'
+    first, rest = re.compile(field), re.compile(b'\n' + field)
+    index = { name.encode(): i for i, name in enumerate(fields) }
+    with open(pathname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            record = None
+            matches = itertools.chain(filter(None, [first.match(data)]), rest.finditer(data))
+            try:
+                for match in matches:
+                    name, value = match.groups()
+                    i = index[name]
+                    if i == 0:
+                        if record is not None:
+                            yield tuple(record)
+                        record = [None] * len(fields)
+                    if record is not None:
+                        record[i] = (b' '.join(value.split()) if b'\n' in value else value.strip()).decode()
+            finally:
+                # The matches refer to the mapped memory, which can
+                # not be closed before they are released.
+                match = matches = None
+        if record is not None:
+            yield tuple(record)
+
+def _architecture(arch, native):
+    # Like APT, packages for all architectures belong to the native
+    # architecture.
+    return native if arch is None or arch == 'all' else arch
+
+def read_status(apt_pkg, pathname, native):
+    current_states = _current_states(apt_pkg)
+    selected_states = _selected_states(apt_pkg)
+    without_version = { apt_pkg.CURSTATE_NOT_INSTALLED, apt_pkg.CURSTATE_CONFIG_FILES }
+    result = {}
+    for name, arch, status, ver_str in scan(pathname, ('Package', 'Architecture', 'Status', 'Version')):
+        want, flag, status = status.split()
+        current_state = current_states[status]
+        result[(name, _architecture(arch, native))] = (
+            current_state, selected_states[want], None if current_state in without_version else ver_str)
+    return result
+
+def read_extended_states(apt_pkg, pathname, native):
+    result = set()
+    for name, arch, auto in scan(pathname, ('Package', 'Architecture', 'Auto-Installed')):
+        if auto == '1':
+            result.add((name, _architecture(arch, native)))
+    return result
+
+def load(apt_pkg, status, extended_states, native):
+    # The extended_states file is optional. Without it, no package is
+    # marked as automatically installed.
+    auto = read_extended_states(apt_pkg, extended_states, native) if extended_states else set()
+    unknown = (apt_pkg.CURSTATE_NOT_INSTALLED, apt_pkg.SELSTATE_UNKNOWN, None)
+    return InstalledState(read_status(apt_pkg, status, native), auto, unknown)
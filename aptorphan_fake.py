@@ -0,0 +1,155 @@
+# Synthetic in-memory repository for tests and benchmarks.
+#
+# The generated universes resemble a Debian archive: layered
+# dependencies with or-groups, virtual packages with one or more
+# providers, Conflicts/Breaks/Replaces, multiarch library packages and
+# a mix of install states. The universe is stored in the same flat
+# format as the on-disk snapshot, so that all scripts can use it in
+# place of the APT cache.
+
+import random
+
+import aptorphan_snapshot
+
+# The values of the apt_pkg constants used by aptorphan.
+PRI_REQUIRED, PRI_IMPORTANT, PRI_STANDARD, PRI_OPTIONAL, PRI_EXTRA = 1, 2, 3, 4, 5
+CURSTATE_NOT_INSTALLED, CURSTATE_CONFIG_FILES, CURSTATE_INSTALLED = 0, 5, 6
+SELSTATE_UNKNOWN, SELSTATE_INSTALL, SELSTATE_DEINSTALL = 0, 1, 3
+
+class Universe(object):
+    def __init__(self, size, seed=0, architectures=('amd64', 'i386'), virtual_ratio=0.02, or_ratio=0.1,
+                 conflicts_ratio=0.02, replaces_ratio=0.01, multiarch_ratio=0.1, upgrade_ratio=0.02,
+                 installed_ratio=0.3, auto_ratio=0.7):
+        rnd = random.Random(seed)
+        native = architectures[0]
+        self.architectures = list(architectures)
+        self.names = ['pkg{:06d}'.format(i) for i in range(size)]
+        self.__packages = {} # fullname => [id, name, arch, versions, provides]
+        self.__versions = [] # [id, package id, ver_str, arch, priority, section, depends]
+        def add_package(name, arch):
+            p = [len(self.__packages), name, arch, [], []]
+            self.__packages['{}:{}'.format(name, arch)] = p
+            return p
+        def add_version(p, ver_str, priority):
+            v = [len(self.__versions), p[0], ver_str, p[2], priority, 'misc', []]
+            self.__versions.append(v)
+            p[3].append(v)
+            return v
+        # The packages are created in layers. Dependencies only point
+        # to packages of lower layers, except for a few back edges,
+        # which create cycles like in the real archive.
+        real = []
+        for i, name in enumerate(self.names):
+            p = add_package(name, native)
+            r = rnd.random()
+            priority = (PRI_REQUIRED if r < 0.01 else PRI_IMPORTANT if r < 0.02
+                        else PRI_STANDARD if r < 0.05 else PRI_OPTIONAL)
+            add_version(p, '1.0-1', priority)
+            if rnd.random() < upgrade_ratio:
+                add_version(p, '0.9-1', priority)
+            real.append(p)
+            if rnd.random() < multiarch_ratio:
+                for arch in architectures[1:]:
+                    q = add_package(name, arch)
+                    for v in p[3]:
+                        add_version(q, v[2], v[4])
+        virtuals = []
+        for i in range(int(size * virtual_ratio)):
+            v = add_package('virtual{:05d}'.format(i), native)
+            for provider in rnd.sample(real, min(len(real), rnd.choice((0, 1, 1, 2, 3, 4)))):
+                v[4].append(provider)
+            virtuals.append(v)
+        # Only Recommends and Suggests may refer to virtual packages
+        # without providers, as in a consistent archive.
+        provided = [v for v in virtuals if v[4]]
+        def pick(index, kind):
+            choices = virtuals if kind in ('Recommends', 'Suggests') else provided
+            if choices and rnd.random() < virtual_ratio * 5:
+                return rnd.choice(choices)
+            if index > 0 and rnd.random() < 0.98:
+                return real[int(index * rnd.random() ** 2)]
+            return rnd.choice(real)
+        for index, p in enumerate(real):
+            for v in p[3]:
+                depends = {}
+                for kind, count in (('Depends', rnd.randint(0, 4)), ('PreDepends', rnd.random() < 0.05),
+                                    ('Recommends', rnd.randint(0, 2)), ('Suggests', rnd.randint(0, 2))):
+                    for j in range(int(count)):
+                        group = [pick(index, kind)]
+                        while rnd.random() < or_ratio and len(group) < 4:
+                            group.append(pick(index, kind))
+                        depends.setdefault(kind, []).append(group)
+                for kind, ratio in (('Conflicts', conflicts_ratio), ('Breaks', conflicts_ratio), ('Replaces', replaces_ratio)):
+                    if rnd.random() < ratio:
+                        depends.setdefault(kind, []).append([rnd.choice(real + virtuals)])
+                v[6] = depends
+        for q in self.__packages.values():
+            if q[2] != native:
+                p = self.__packages['{}:{}'.format(q[1], native)]
+                for v, w in zip(q[3], p[3]):
+                    v[6] = w[6]
+        # Install states: installed versions are mostly candidates,
+        # some are outdated and a few packages only left their
+        # configuration files on the system.
+        self.__states = {}
+        for p in self.__packages.values():
+            if p[3] and rnd.random() < installed_ratio:
+                r = rnd.random()
+                if r < 0.03:
+                    state = (CURSTATE_CONFIG_FILES, SELSTATE_DEINSTALL, None)
+                else:
+                    state = (CURSTATE_INSTALLED, SELSTATE_INSTALL, p[3][-1][0] if r < 0.1 else p[3][0][0])
+                self.__states[p[0]] = state + (rnd.random() < auto_ratio,)
+        self.__tables = None
+    def tables(self):
+        if self.__tables is None:
+            self.__tables = self.__make_tables()
+        return self.__tables
+    def __make_tables(self):
+        native = self.architectures[0]
+        packages = []
+        for fullname, (id, name, arch, versions, provides) in self.__packages.items():
+            current_state, selected_state, current_ver, auto = self.__states.get(
+                id, (CURSTATE_NOT_INSTALLED, SELSTATE_UNKNOWN, None, False))
+            pretty_name = name if arch == native else fullname
+            packages.append((
+                id, name, arch, fullname, pretty_name, current_state, selected_state, current_ver,
+                versions[0][0] if versions else None, auto, tuple(v[0] for v in versions),
+                tuple((name, '', v[0]) for p in provides for v in p[3][:1])))
+        providers = {}
+        for id, name, arch, versions, provides in self.__packages.values():
+            for p in provides:
+                providers.setdefault(id, []).append(p[3][0][0])
+        versions = []
+        for id, package, ver_str, arch, priority, section, depends in self.__versions:
+            def target(p):
+                # Dependencies on multiarch packages resolve to the
+                # package of the same architecture.
+                q = self.__packages.get('{}:{}'.format(p[1], arch), p)
+                targets = tuple(v[0] for v in q[3]) + tuple(providers.get(q[0], ()))
+                return (q[0], '', '', targets)
+            versions.append((
+                id, package, ver_str, arch, priority, section, (('fake', 'main'),),
+                tuple((kind, tuple(tuple(target(p) for p in or_group) for or_group in and_group))
+                      for kind, and_group in sorted(depends.items()))))
+        return self.architectures, packages, versions
+    def snapshot(self):
+        return aptorphan_snapshot.Snapshot(*self.tables())
+    def status(self):
+        # Returns the installed state as a dpkg status file. The fields,
+        # that aptorphan does not read, are added with typical sizes.
+        current_states = { CURSTATE_CONFIG_FILES: 'config-files', CURSTATE_INSTALLED: 'installed' }
+        selected_states = { SELSTATE_INSTALL: 'install', SELSTATE_DEINSTALL: 'deinstall' }
+        stanzas = []
+        for id, name, arch, versions, provides in self.__packages.values():
+            if id in self.__states:
+                current_state, selected_state, current_ver, auto = self.__states[id]
+                ver_str = versions[0][2] if current_ver is None else self.__versions[current_ver][2]
+                stanzas.append(
+                    'Package: {}\nStatus: {} ok {}\nPriority: optional\nSection: misc\nInstalled-Size: {}\n'
+                    'Maintainer: Somebody <somebody@example.org>\nArchitecture: {}\nVersion: {}\n'
+                    'Conffiles:\n /etc/{}/{}.conf 0123456789abcdef0123456789abcdef\n'
+                    'Description: package {}\n{}'.format(
+                        name, selected_states[selected_state], current_states[current_state], id, arch, ver_str,
+                        name, arch, name, ' Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n' * 12))
+        return '\n'.join(stanzas)
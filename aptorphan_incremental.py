@@ -0,0 +1,52 @@
+# Persisted state for the incremental mode of aptorphan.
+#
+# The ranking only depends on the archive and the wishlist. It is
+# stored together with the installed state and the explanations of the
+# last report. The checkpoint of the base ranking is stored the same
+# way with an empty wishlist. The state is keyed on srcpkgcache.bin,
+# which APT only rebuilds when the sources change, and not after each
+# dpkg run like pkgcache.bin, and on the lists of APT, which change
+# with each update. If one of them is missing (e.g. if the caches are
+# disabled), the state is never reused. The APT preferences are part of
+# the key like for the snapshot, because pinning changes the candidate
+# versions. Packages and versions are identified by name and version
+# string, because the ids change whenever APT rebuilds its cache.
+
+import pickle
+
+import aptorphan_snapshot
+
+FORMAT = 2
+
+def find_state_files(config):
+    # Returns the required and the optional files of the key.
+    required = (config.find_file('Dir::Cache::srcpkgcache'), config.find_dir('Dir::State::lists'))
+    return required, aptorphan_snapshot.find_preference_files(config)
+
+def make_key(files, previous=None):
+    required, optional = files
+    return aptorphan_snapshot.make_key(required + optional, previous, optional)
+
+def is_complete(key):
+    return None not in key.values()
+
+def default_pathname(config, name='aptorphan.state'):
+    return aptorphan_snapshot.cache_pathname(config, name)
+
+def load(pathname, files, wishlist):
+    # Returns the stored state, or None if the archive or the wishlist
+    # have changed or the file can not be read, and the current key.
+    try:
+        with open(pathname, 'rb') as f:
+            format, key, stored = pickle.load(f)
+            if format != FORMAT:
+                return None, make_key(files)
+            current = make_key(files, key)
+            if stored != wishlist or not is_complete(current) or not aptorphan_snapshot.same_key(key, current):
+                return None, current
+            return pickle.load(f), current
+    except Exception:
+        return None, make_key(files)
+
+def save(pathname, key, wishlist, state):
+    aptorphan_snapshot.write(pathname, (FORMAT, key, wishlist), state)
@@ -0,0 +1,52 @@
+# Glob and regular expression patterns for wishlist entries.
+#
+# An entry containing one of '*?[' is a glob pattern, and an entry
+# enclosed in slashes like '/python3-(foo|bar)/' is a regular
+# expression. Both have to match the whole package name. Patterns only
+# match names with an architecture qualifier, if they contain a colon
+# themselves.
+#
+# The names are kept in a sorted list, that is built once. A pattern
+# only examines the range of names starting with its literal prefix,
+# so that most patterns do not scan all packages.
+
+import bisect
+import fnmatch
+import re
+
+def is_pattern(entry):
+    return is_regex(entry) or any(c in entry for c in '*?[')
+
+def is_regex(entry):
+    return len(entry) > 2 and entry.startswith('/') and entry.endswith('/')
+
+def _literal_prefix(entry):
+    if is_regex(entry):
+        expression = entry[1:-1]
+        if '|' in expression:
+            return '' # alternatives have no common prefix
+        prefix = re.match(r'[a-z0-9-]*', expression).group()
+        if expression[len(prefix):len(prefix) + 1] in ('?', '*', '{'):
+            prefix = prefix[:-1] # the last character is optional
+        return prefix
+    return re.match(r'[^*?[]*', entry).group()
+
+class NameIndex(object):
+    def __init__(self, names):
+        self.__names = sorted(names)
+    def expand(self, entry):
+        # Returns the matching names in sorted order.
+        if is_regex(entry):
+            match = re.compile(entry[1:-1]).fullmatch
+        else:
+            match = re.compile(fnmatch.translate(entry)).match
+        qualified = ':' in entry
+        prefix = _literal_prefix(entry)
+        start = bisect.bisect_left(self.__names, prefix)
+        result = []
+        for name in self.__names[start:]:
+            if not name.startswith(prefix):
+                break
+            if (qualified or ':' not in name) and match(name):
+                result.append(name)
+        return result
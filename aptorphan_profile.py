@@ -0,0 +1,98 @@
+# Opt-in instrumentation for the scripts.
+#
+# The profiler measures wall time and CPU time for each phase, and how
+# much the peak resident set size of the process has grown during the
+# phase, and it collects counters. If requested, one
+# phase is recorded with cProfile and written to a file, that can be
+# inspected with pstats or snakeviz. With --profile-memory, the Python
+# allocations are traced with tracemalloc, which shows the memory in
+# use and the peak per phase, and the largest allocation sites. That
+# makes the program considerably slower. Without --profile, phase()
+# only yields.
+
+import cProfile
+import contextlib
+import resource
+import sys
+import time
+import tracemalloc
+
+class Profiler(object):
+    def __init__(self, enabled=False, output=None, hot=None, memory=False):
+        self.enabled = enabled
+        self.__output = output
+        self.__hot = hot
+        self.__memory = memory
+        if memory:
+            tracemalloc.start()
+        self.__phases = []
+        self.__counters = {}
+        self.__current = None
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile() if self.__output and name == self.__hot else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.__memory:
+            tracemalloc.reset_peak() # the peak of an enclosing phase gets lost
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                profile.dump_stats(self.__output)
+            # The peak resident set size is the high-water mark of the
+            # process. The growth shows which phase raised it, while the
+            # traced peak is the one of the phase itself.
+            self.__phases.append((
+                name, time.perf_counter() - wall, time.process_time() - cpu,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, peak,
+                tracemalloc.get_traced_memory() if self.__memory else None))
+    def switch(self, name=None):
+        # Ends the current phase and starts the next one. That is more
+        # convenient than phase() for scripts with linear steps.
+        if self.__current is not None:
+            self.__current.__exit__(None, None, None)
+            self.__current = None
+        if name is not None:
+            self.__current = self.phase(name)
+            self.__current.__enter__()
+    def count(self, counters):
+        for name, value in counters.items():
+            self.__counters[name] = self.__counters.get(name, 0) + value
+    def report(self, file=sys.stderr):
+        if not self.enabled:
+            return
+        write = lambda format, *args: file.write(format.format(*args))
+        for name, wall, cpu, peak, previous, traced in self.__phases:
+            write('profile: {:<12} wall {:8.3f}s  cpu {:8.3f}s  process peak rss {:8d} KiB (+{:d} KiB)',
+                  name, wall, cpu, peak, peak - previous)
+            if traced:
+                write('  traced {:8d} KiB  traced peak {:8d} KiB', traced[0] >> 10, traced[1] >> 10)
+            write('\n')
+        for name, value in self.__counters.items():
+            write('profile: {}: {}\n', name, value)
+        if self.__memory:
+            for statistic in tracemalloc.take_snapshot().statistics('lineno')[:10]:
+                frame = statistic.traceback[0]
+                write('profile: memory: {}:{} {} KiB in {} blocks\n',
+                      frame.filename, frame.lineno, statistic.size >> 10, statistic.count)
+
+def add_arguments(parser, phases, hot):
+    parser.add_argument('--profile', action='store_true',
+                        help='print time and memory per phase and counters to stderr')
+    parser.add_argument('--profile-output', metavar='PATH',
+                        help='write cProfile data of one phase to PATH (implies --profile)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='trace the Python allocations per phase with tracemalloc (implies --profile, slow)')
+    parser.add_argument('--profile-phase', metavar='PHASE', choices=phases, default=hot,
+                        help='phase recorded with cProfile, one of {} (default: %(default)s)'.format(', '.join(phases)))
+
+def from_arguments(args):
+    return Profiler(args.profile or bool(args.profile_output) or args.profile_memory,
+                    args.profile_output, args.profile_phase, args.profile_memory)
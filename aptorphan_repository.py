@@ -0,0 +1,111 @@
+# Shared access to the APT cache for the aptorphan scripts.
+#
+# The repository hides whether the packages come from the APT cache
+# or from a snapshot, and whether the installed state is the one of
+# the local system or read from a dpkg status file. A single
+# repository can be used by several commands in the same process.
+
+import os
+
+import apt_pkg
+
+import aptorphan_dpkg
+import aptorphan_names
+import aptorphan_snapshot
+
+class Dict(dict):
+    def compute_if_absent(self, key, mapping):
+        try:
+            return self[key]
+        except KeyError:
+            pass # unwind exception stack
+        return self.setdefault(key, mapping(key))
+
+class Repository(object):
+    def __init__(self, snapshot=None, jobs=1):
+        # The snapshot is either a pathname, True for the default
+        # location, or an already loaded (or synthetic) snapshot. If
+        # the snapshot has to be created, the dependencies are
+        # extracted by the given number of worker processes.
+        if snapshot is None:
+            apt_pkg.init()
+            cache = apt_pkg.Cache(progress=None)
+            depcache = apt_pkg.DepCache(cache)
+            self.find_architectures = apt_pkg.get_architectures
+        else:
+            if not isinstance(snapshot, aptorphan_snapshot.Snapshot):
+                apt_pkg.init()
+                snapshot = aptorphan_snapshot.open_snapshot(apt_pkg, None if snapshot is True else snapshot, jobs)
+            cache = depcache = snapshot
+            self.find_architectures = lambda: cache.architectures
+        self.find_packages = lambda: cache.packages
+        self.find_candidate_version = depcache.get_candidate_ver
+        self.find_package_by_name = lambda name: cache[name] if name in cache else None
+        # The installed state can be replaced by the state of another
+        # host, e.g. read from a dpkg status file.
+        self.find_current_state = lambda package: package.current_state
+        self.find_selected_state = lambda package: package.selected_state
+        self.find_current_version = lambda package: package.current_ver
+        self.is_auto_installed = depcache.is_auto_installed
+        self.__positions = None
+        self.__names = None
+    def use_installed_state(self, state):
+        self.find_current_state = state.current_state
+        self.find_selected_state = state.selected_state
+        self.find_current_version = state.current_version
+        self.is_auto_installed = state.is_auto_installed
+    def find_installed_states(self):
+        # Returns the installed state of all packages known to dpkg by
+        # their full names.
+        result = {}
+        for p in self.find_packages():
+            current_state, selected_state = self.find_current_state(p), self.find_selected_state(p)
+            auto = bool(self.is_auto_installed(p))
+            if current_state != apt_pkg.CURSTATE_NOT_INSTALLED or selected_state != apt_pkg.SELSTATE_UNKNOWN or auto:
+                v = self.find_current_version(p)
+                result[p.get_fullname()] = (current_state, selected_state, v and v.ver_str, auto)
+        return result
+    def find_packages_by_pattern(self, pattern):
+        # The index of the names is built on first use. It only
+        # contains packages with versions.
+        if self.__names is None:
+            self.__names = aptorphan_names.NameIndex(
+                p.get_fullname(pretty=True) for p in self.find_packages() if p.has_versions)
+        return [ self.find_package_by_name(name) for name in self.__names.expand(pattern) ]
+    def find_candidate_versions(self, priorities):
+        # Returns the candidate versions with one of the given
+        # priorities grouped by (priority, arch). The position of each
+        # package in the cache is recorded in the same pass.
+        positions = {}
+        result = {}
+        for position, p in enumerate(self.find_packages()):
+            positions[p.id] = position
+            if p.has_versions:
+                v = self.find_candidate_version(p)
+                if v is not None and v.priority in priorities:
+                    result.setdefault((v.priority, v.arch), []).append(v)
+        self.__positions = positions
+        return result
+    def find_package_position(self, package):
+        if self.__positions is None:
+            self.find_candidate_versions(())
+        return self.__positions[package.id]
+
+def add_arguments(parser):
+    parser.add_argument('--snapshot', action='store_true',
+                        help='reuse a snapshot of the APT cache as long as the cache is unchanged')
+    parser.add_argument('--snapshot-file', metavar='PATH',
+                        help='location of the snapshot (implies --snapshot, default: next to the cache)')
+    parser.add_argument('--snapshot-jobs', metavar='N', type=int, default=os.cpu_count(),
+                        help='number of worker processes extracting the dependencies, when the snapshot is created (default: %(default)s)')
+    parser.add_argument('--status', metavar='PATH',
+                        help='read the installed packages from a dpkg status file instead of the APT cache')
+    parser.add_argument('--extended-states', metavar='PATH',
+                        help='read the automatically installed packages from an APT extended_states file (with --status)')
+
+def from_arguments(args):
+    repository = Repository(args.snapshot_file or args.snapshot or None, args.snapshot_jobs)
+    if args.status:
+        native = repository.find_architectures()[0]
+        repository.use_installed_state(aptorphan_dpkg.load(apt_pkg, args.status, args.extended_states, native))
+    return repository
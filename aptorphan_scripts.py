@@ -0,0 +1,14 @@
+# Access to the aptorphan scripts from other scripts and the tests.
+#
+# The scripts have dashes in their names and can not be imported, so
+# they are loaded from the directory of this module.
+
+import importlib.util
+import os
+
+def load_script(name):
+    pathname = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_')[:-3], pathname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,405 @@
+# Compact on-disk snapshot of the APT cache.
+#
+# The snapshot contains all packages, versions, candidate versions,
+# priorities, architectures and dependency edges in a flat format
+# based on tuples and integer ids. The objects reconstructed from a
+# snapshot provide the subset of the apt_pkg interface used by
+# aptorphan, so that they can be used in place of apt_pkg.Cache and
+# apt_pkg.DepCache.
+#
+# The snapshot is keyed on the files APT and dpkg use to store their
+# state, and on the APT preferences, which select the candidate
+# versions. It is reused as long as all of the state files exist, their
+# size is unchanged and either the modification time or the content
+# hash matches. The preferences may be missing, as long as they are
+# still missing.
+
+import hashlib
+import multiprocessing
+import os
+import pickle
+import stat
+import sys
+
+FORMAT = 1
+
+class PackageFile(object):
+    __slots__ = ('origin', 'component')
+    def __init__(self, origin, component):
+        self.origin = origin
+        self.component = component
+
+class Dependency(object):
+    __slots__ = ('__snapshot', 'parent_ver', 'dep_type', 'target_pkg', 'comp_type', 'target_ver', '__targets')
+    def __init__(self, snapshot, parent_ver, dep_type, target_pkg, comp_type, target_ver, targets):
+        self.__snapshot = snapshot
+        self.parent_ver = parent_ver
+        self.dep_type = dep_type
+        self.target_pkg = target_pkg
+        self.comp_type = comp_type
+        self.target_ver = target_ver
+        self.__targets = targets
+    @property
+    def parent_pkg(self):
+        return self.parent_ver.parent_pkg
+    def all_targets(self):
+        return [self.__snapshot.versions[id] for id in self.__targets]
+
+class Version(object):
+    # The package files and the dependencies are kept in the flat
+    # format, and the objects are only created for versions, that are
+    # actually inspected.
+    __slots__ = ('__snapshot', 'id', 'parent_pkg', 'ver_str', 'arch', 'priority', 'section', '__files', 'flat_depends', '__depends_list')
+    def __init__(self, snapshot, id, parent_pkg, ver_str, arch, priority, section, files, depends):
+        self.__snapshot = snapshot
+        self.id = id
+        self.parent_pkg = parent_pkg
+        self.ver_str = ver_str
+        self.arch = arch
+        self.priority = priority
+        self.section = section
+        self.__files = files
+        self.flat_depends = depends
+        self.__depends_list = None
+    @property
+    def file_list(self):
+        return [(self.__snapshot.package_file(origin, component), index) for index, (origin, component) in enumerate(self.__files)]
+    @property
+    def provides_list(self):
+        return [(name, version, self) for name, version in self.__snapshot.provides(self.id)]
+    @property
+    def depends_list(self):
+        if self.__depends_list is None:
+            packages = self.__snapshot.packages_by_id
+            self.__depends_list = {
+                kind: [[Dependency(self.__snapshot, self, kind, packages[target_pkg], comp_type, target_ver, targets)
+                        for target_pkg, comp_type, target_ver, targets in or_group]
+                       for or_group in and_group]
+                for kind, and_group in self.flat_depends}
+        return self.__depends_list
+
+class Package(object):
+    __slots__ = ('__snapshot', 'id', 'name', 'architecture', '__fullname', '__pretty_name',
+                 'current_state', 'selected_state', '__current_ver', '__version_list', '__provides_list')
+    def __init__(self, snapshot, id, name, architecture, fullname, pretty_name, current_state, selected_state,
+                 current_ver, version_list, provides_list):
+        self.__snapshot = snapshot
+        self.id = id
+        self.name = name
+        self.architecture = architecture
+        self.__fullname = fullname
+        self.__pretty_name = pretty_name
+        self.current_state = current_state
+        self.selected_state = selected_state
+        self.__current_ver = current_ver
+        self.__version_list = version_list
+        self.__provides_list = provides_list
+    def get_fullname(self, pretty=False):
+        return self.__pretty_name if pretty else self.__fullname
+    @property
+    def has_versions(self):
+        return bool(self.__version_list)
+    @property
+    def has_provides(self):
+        return bool(self.__provides_list)
+    @property
+    def current_ver(self):
+        return None if self.__current_ver is None else self.__snapshot.versions[self.__current_ver]
+    @property
+    def version_list(self):
+        return [self.__snapshot.versions[id] for id in self.__version_list]
+    @property
+    def provides_list(self):
+        return [(name, version, self.__snapshot.versions[id]) for name, version, id in self.__provides_list]
+    @property
+    def rev_depends_list(self):
+        return self.__snapshot.rev_depends(self.id)
+
+class Table(object):
+    # Maps the ids to the objects, which are created from the flat rows
+    # on first access.
+    def __init__(self, rows, create):
+        self.__rows = { row[0]: row for row in rows }
+        self.__create = create
+        self.__objects = {}
+    def __len__(self):
+        return len(self.__rows)
+    def row(self, id):
+        return self.__rows[id]
+    def rows(self):
+        return self.__rows.values()
+    def __getitem__(self, id):
+        try:
+            return self.__objects[id]
+        except KeyError:
+            pass # unwind exception stack
+        return self.__objects.setdefault(id, self.__create(*self.__rows[id]))
+
+class Snapshot(object):
+    # Loading a snapshot only indexes the flat rows. The packages and
+    # versions are created on first access, so that a run only pays for
+    # the part of the archive it inspects.
+    def __init__(self, architectures, packages, versions):
+        self.architectures = architectures
+        self.packages_by_id = Table(packages, self.__new_package)
+        self.versions = Table(versions, self.__new_version)
+        self.__packages = None
+        self.__names = None
+        self.__rev_depends = None
+        self.__provides = None
+        self.__package_files = {}
+    def __new_package(self, id, name, architecture, fullname, pretty_name, current_state, selected_state,
+                      current_ver, candidate_ver, auto, version_list, provides_list):
+        return Package(self, id, name, architecture, fullname, pretty_name, current_state, selected_state,
+                       current_ver, version_list, provides_list)
+    def __new_version(self, id, package, ver_str, arch, priority, section, files, depends):
+        return Version(self, id, self.packages_by_id[package], ver_str, arch, priority, section, files, depends)
+    @property
+    def packages(self):
+        if self.__packages is None:
+            self.__packages = [self.packages_by_id[row[0]] for row in self.packages_by_id.rows()]
+        return self.__packages
+    def __find_names(self):
+        if self.__names is None:
+            self.__names = {}
+            for row in self.packages_by_id.rows():
+                self.__names[row[3]] = row[0]
+                self.__names.setdefault(row[4], row[0])
+        return self.__names
+    def __contains__(self, name):
+        return name in self.__find_names()
+    def __getitem__(self, name):
+        return self.packages_by_id[self.__find_names()[name]]
+    def get_candidate_ver(self, package):
+        id = self.packages_by_id.row(package.id)[8]
+        return None if id is None else self.versions[id]
+    def is_auto_installed(self, package):
+        return self.packages_by_id.row(package.id)[9]
+    def package_file(self, origin, component):
+        key = (origin, component)
+        try:
+            return self.__package_files[key]
+        except KeyError:
+            return self.__package_files.setdefault(key, PackageFile(origin, component))
+    def provides(self, version_id):
+        if self.__provides is None:
+            # The inverse of the provides of the virtual packages,
+            # built on first use.
+            self.__provides = {}
+            for row in self.packages_by_id.rows():
+                for name, version, id in row[11]:
+                    self.__provides.setdefault(id, []).append((name, version))
+        return self.__provides.get(version_id, ())
+    def rev_depends(self, package_id):
+        if self.__rev_depends is None:
+            # Build the reverse index for all packages at once on
+            # first use. It is only required for the explanations. It
+            # refers to the flat dependencies, so that the objects are
+            # only created for the queried packages.
+            self.__rev_depends = {}
+            for row in self.versions.rows():
+                for kind, and_group in row[7]:
+                    for or_group in and_group:
+                        for d in or_group:
+                            self.__rev_depends.setdefault(d[0], []).extend((row[0], kind, d))
+        packages = self.packages_by_id
+        entries = self.__rev_depends.get(package_id, ())
+        return [Dependency(self, self.versions[id], kind, packages[target_pkg], comp_type, target_ver, targets)
+                for id, kind, (target_pkg, comp_type, target_ver, targets) in zip(entries[0::3], entries[1::3], entries[2::3])]
+
+def capture_versions(p):
+    return [(
+        v.id, p.id, v.ver_str, v.arch, v.priority, v.section,
+        tuple((f.origin, f.component) for f, index in v.file_list),
+        tuple((kind, tuple(tuple((d.target_pkg.id, d.comp_type, d.target_ver, tuple(t.id for t in d.all_targets()))
+                                 for d in or_group)
+                           for or_group in and_group))
+              for kind, and_group in v.depends_list.items()))
+            for v in p.version_list]
+
+_cache = None
+
+def _open_cache(open_cache):
+    global _cache
+    _cache = open_cache()
+
+def _capture_partition(partition):
+    start, stop = partition
+    packages = _cache.packages
+    return [(p.id, capture_versions(p)) for p in (packages[index] for index in range(start, stop))]
+
+def _capture_packages(cache, depcache, versions=None):
+    # Returns the packages, and optionally adds their versions.
+    packages = []
+    for p in cache.packages:
+        current = p.current_ver
+        candidate = depcache.get_candidate_ver(p) if p.has_versions else None
+        packages.append((
+            p.id, p.name, p.architecture,
+            p.get_fullname(pretty=False), p.get_fullname(pretty=True),
+            p.current_state, p.selected_state,
+            None if current is None else current.id,
+            None if candidate is None else candidate.id,
+            bool(depcache.is_auto_installed(p)),
+            tuple(v.id for v in p.version_list),
+            tuple((name, version, v.id) for name, version, v in p.provides_list)))
+        if versions is not None:
+            versions.extend(capture_versions(p))
+    return packages
+
+def capture(cache, depcache, architectures, open_cache=None, jobs=1):
+    # With several jobs, the versions are converted into the flat
+    # format in worker processes. The apt_pkg objects can not be
+    # pickled, so each worker opens the cache itself and returns the
+    # versions of the packages in a range of positions. There are more
+    # ranges than workers, so that the load is balanced. The parent
+    # process captures the packages in the meantime and merges the
+    # versions in the order of the cache.
+    versions = []
+    if jobs > 1:
+        total = len(cache.packages)
+        count = jobs * 4
+        ranges = [(total * index // count, total * (index + 1) // count) for index in range(count)]
+        with multiprocessing.get_context('fork').Pool(jobs, initializer=_open_cache, initargs=(open_cache,)) as pool:
+            partitions = pool.imap_unordered(_capture_partition, ranges)
+            packages = _capture_packages(cache, depcache)
+            captured = {}
+            for partition in partitions:
+                captured.update(partition)
+        for id, *rest in packages:
+            versions.extend(captured[id])
+    else:
+        packages = _capture_packages(cache, depcache, versions)
+    return architectures, packages, versions
+
+def find_state_files(config):
+    return (
+        config.find_file('Dir::Cache::pkgcache'),
+        config.find_file('Dir::Cache::srcpkgcache'),
+        config.find_file('Dir::State::status'),
+        config.find_file('Dir::State::extended_states'),
+        )
+
+def find_preference_files(config):
+    # The pinning in these files changes the candidate versions without
+    # touching the state files. Usually, only the directory exists.
+    return (config.find_file('Dir::Etc::preferences'), config.find_dir('Dir::Etc::preferencesparts'))
+
+def cache_pathname(config, name):
+    # Next to the APT cache, or in the cache directory of the user, if
+    # the APT cache directory is not writable (e.g. without root).
+    directory = config.find_dir('Dir::Cache')
+    if not os.access(directory, os.W_OK):
+        directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'aptorphan')
+    return os.path.join(directory, name)
+
+def default_pathname(config):
+    return cache_pathname(config, 'aptorphan.snapshot')
+
+def _hash_file(pathname):
+    h = hashlib.blake2b(digest_size=20)
+    with open(pathname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.digest()
+
+def _hash_directory(pathname):
+    # The files in the directory are replaced instead of modified, like
+    # the lists of APT, so the names, sizes and modification times are
+    # sufficient.
+    h = hashlib.blake2b(digest_size=20)
+    for entry in sorted(os.scandir(pathname), key=lambda entry: entry.name):
+        st = entry.stat()
+        h.update('{}\0{}\0{}\n'.format(entry.name, st.st_size, st.st_mtime_ns).encode())
+    return h.digest()
+
+MISSING = (None, None, None)
+
+def make_key(pathnames, previous=None, optional=()):
+    # The content hash is only computed, if the modification time has
+    # changed. That avoids reading the whole cache on every run. The
+    # entry of a missing file is None, and the entry of a missing
+    # optional file is MISSING, which matches as long as the file does
+    # not exist.
+    key = {}
+    for pathname in pathnames:
+        try:
+            st = os.stat(pathname)
+        except FileNotFoundError:
+            key[pathname] = MISSING if pathname in optional else None
+            continue
+        old = previous and previous.get(pathname)
+        if stat.S_ISDIR(st.st_mode):
+            digest = _hash_directory(pathname)
+        elif old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            digest = old[2]
+        else:
+            digest = _hash_file(pathname)
+        key[pathname] = (st.st_size, st.st_mtime_ns, digest)
+    return key
+
+def same_key(old, new):
+    # A missing file never matches, because it can not be told whether
+    # the state has changed in the meantime.
+    if old.keys() != new.keys():
+        return False
+    for pathname, value in new.items():
+        if value is None or old[pathname] is None:
+            return False
+        if (value[0], value[2]) != (old[pathname][0], old[pathname][2]):
+            return False
+    return True
+
+def load(pathname, files, optional=()):
+    # Any file, that can not be read, is treated like an outdated one,
+    # e.g. if it is truncated or has been written by another version.
+    # The format is checked before the data is unpickled.
+    try:
+        with open(pathname, 'rb') as f:
+            format, key = pickle.load(f)
+            if format != FORMAT:
+                return None, make_key(files, None, optional)
+            current = make_key(files, key, optional)
+            if not same_key(key, current):
+                return None, current
+            return Snapshot(*pickle.load(f)), current
+    except Exception:
+        return None, make_key(files, None, optional)
+
+def write(pathname, *objects):
+    # Writes the pickled objects atomically. The file is optional.
+    # Continue without it, if for example the directory is not
+    # writable, but warn about it, because every run pays for it.
+    temporary = '{}.{}.tmp'.format(pathname, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(pathname) or '.', exist_ok=True)
+        with open(temporary, 'wb') as f:
+            for o in objects:
+                pickle.dump(o, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, pathname)
+    except OSError as e:
+        sys.stderr.write('warning: can not write {}: {}\n'.format(pathname, e))
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+
+def save(pathname, key, data):
+    write(pathname, (FORMAT, key), data)
+
+def open_snapshot(apt_pkg, pathname=None, jobs=1):
+    optional = find_preference_files(apt_pkg.config)
+    files = find_state_files(apt_pkg.config) + optional
+    pathname = pathname or default_pathname(apt_pkg.config)
+    snapshot, key = load(pathname, files, optional)
+    if snapshot is None:
+        # The cache is opened (and possibly rebuilt) before the workers
+        # are started, so that they only map the existing files.
+        open_cache = lambda: apt_pkg.Cache(progress=None)
+        cache = open_cache()
+        depcache = apt_pkg.DepCache(cache)
+        data = capture(cache, depcache, apt_pkg.get_architectures(), open_cache, jobs)
+        if None not in key.values():
+            save(pathname, key, data)
+        snapshot = Snapshot(*data)
+    return snapshot
@@ -0,0 +1,216 @@
+import contextlib
+import io
+import json
+import os
+import pickle
+import runpy
+import sys
+import types
+
+import pytest
+
+from conftest import ROOT
+
+apt_pkg = pytest.importorskip('apt_pkg')
+
+import aptorphan
+import aptorphan_fake
+import aptorphan_incremental
+import aptorphan_profile
+import aptorphan_snapshot
+
+def explain(universe, step, repository=None, release=False, **kwargs):
+    # Returns the report and the explanations of the run.
+    manager = aptorphan.Manager(repository or aptorphan.Repository(universe.snapshot()))
+    for name in universe.names[::step]:
+        manager.rank_by_name(name, 'W')
+    manager.rank_unresolved()
+    if release:
+        wrapped = manager.stats()['versions wrapped']
+        manager.release()
+        assert manager.stats()['versions wrapped'] < wrapped
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        explanations = manager.dump_unresolved(**kwargs)
+    return output.getvalue(), explanations
+
+def report(universe, step, repository=None, **kwargs):
+    return explain(universe, step, repository, **kwargs)[0]
+
+def remove_package(snapshot, name):
+    # Returns a repository, in which the given package is not installed.
+    repository = aptorphan.Repository(snapshot)
+    removed = lambda p: p.get_fullname() == name
+    repository.use_installed_state(types.SimpleNamespace(
+        current_state=lambda p: aptorphan_fake.CURSTATE_NOT_INSTALLED if removed(p) else p.current_state,
+        selected_state=lambda p: aptorphan_fake.SELSTATE_UNKNOWN if removed(p) else p.selected_state,
+        current_version=lambda p: None if removed(p) else p.current_ver,
+        is_auto_installed=lambda p: not removed(p) and snapshot.is_auto_installed(p)))
+    return repository
+
+@pytest.mark.parametrize('seed', range(4))
+def test_incremental_explanations_equal_full_run(seed):
+    # Without previous explanations, an incremental run explains all
+    # packages by examining the reverse dependencies of each package
+    # instead of the index over all packages.
+    universe = aptorphan_fake.Universe(1500, seed=seed, or_ratio=0.3, conflicts_ratio=0.05,
+                                       virtual_ratio=0.05, upgrade_ratio=0.2)
+    assert report(universe, 7 + seed, explanations={}, changed=set()) == report(universe, 7 + seed)
+
+@pytest.mark.parametrize('seed', range(2))
+def test_release_keeps_report(seed):
+    # The wrappers dropped after the ranking are created again, where
+    # the report needs them.
+    universe = aptorphan_fake.Universe(3000, seed=seed, or_ratio=0.3, conflicts_ratio=0.05,
+                                       virtual_ratio=0.05, upgrade_ratio=0.2, multiarch_ratio=0.3)
+    assert report(universe, 11, release=True) == report(universe, 11)
+
+def test_incremental_explanations_after_change():
+    # Only the explanations, that depend on the installed state of the
+    # removed package, are created again. The others are reused as they
+    # are, and the report is the same as the one of a full run.
+    universe = aptorphan_fake.Universe(1500, seed=1, or_ratio=0.3, virtual_ratio=0.05, upgrade_ratio=0.2)
+    snapshot = universe.snapshot()
+    text, first = explain(universe, 7, explanations={}, changed=None)
+    removed = next(p.get_fullname() for p in snapshot.packages
+                   if p.current_state == aptorphan_fake.CURSTATE_INSTALLED and first.get(p.get_fullname(), ((),))[0])
+    text, second = explain(universe, 7, remove_package(snapshot, removed), explanations=first, changed={removed})
+    assert text == report(universe, 7, remove_package(snapshot, removed))
+    recomputed = { name for name, entry in second.items() if entry is not first.get(name) }
+    assert recomputed
+    # The targets of the dependencies of the removed package are also
+    # affected, even if they did not watch it.
+    affected = {removed}
+    for or_group in sum(snapshot.get_candidate_ver(snapshot[removed]).depends_list.values(), []):
+        affected.update(dependency.target_pkg.get_fullname() for dependency in or_group)
+        affected.update(t.parent_pkg.get_fullname() for dependency in or_group for t in dependency.all_targets())
+    assert recomputed == { name for name in second if name in affected or name not in first or not first[name][1].isdisjoint(affected) }
+    assert len(recomputed) < len(second)
+
+def add_local_package(universe, name, target):
+    # Returns a snapshot, in which a package, that is not in the archive
+    # (e.g. installed with dpkg -i), depends on the given package.
+    architectures, packages, versions = universe.tables()
+    package, version = len(packages), len(versions)
+    fullname = '{}:{}'.format(name, architectures[0])
+    target = next(row for row in packages if row[3] == target)
+    packages = packages + [(package, name, architectures[0], fullname, name, aptorphan_fake.CURSTATE_INSTALLED,
+                            aptorphan_fake.SELSTATE_INSTALL, version, version, False, (version,), ())]
+    versions = versions + [(version, package, '1.0-1', architectures[0], aptorphan_fake.PRI_OPTIONAL, 'misc',
+                            (('local', 'main'),), (('Depends', (((target[0], '', '', target[10]),),)),))]
+    return aptorphan_snapshot.Snapshot(architectures, packages, versions)
+
+def test_incremental_explanations_after_local_install():
+    # The target of the new package did not watch it, because it was
+    # not in the cache before.
+    universe = aptorphan_fake.Universe(1500, seed=1, or_ratio=0.3, virtual_ratio=0.05, upgrade_ratio=0.2)
+    before = aptorphan.Repository(universe.snapshot())
+    text, first = explain(universe, 7, before, explanations={}, changed=None)
+    target = sorted(first)[0]
+    after = aptorphan.Repository(add_local_package(universe, 'localx', target))
+    installed, previous = after.find_installed_states(), before.find_installed_states()
+    changed = { name for name in installed.keys() | previous.keys() if installed.get(name) != previous.get(name) }
+    assert changed == {'localx:amd64'}
+    text = explain(universe, 7, after, explanations=first, changed=changed)[0]
+    expected = report(universe, 7, aptorphan.Repository(add_local_package(universe, 'localx', target)))
+    assert '  localx[i] depends: {}[2]'.format(target.split(':')[0]) in expected.splitlines()
+    assert text == expected
+
+def test_jsonl_unresolved_records_are_ranked():
+    universe = aptorphan_fake.Universe(1500, seed=1, or_ratio=0.3, virtual_ratio=0.05)
+    output = io.StringIO()
+    report(universe, 7, writer=aptorphan.JsonWriter(output))
+    records = [ json.loads(line) for line in output.getvalue().splitlines() ]
+    unresolved = [ record for record in records if record['action'] == 'unresolved' ]
+    assert unresolved
+    assert all(record['rank'] is not None for record in unresolved)
+
+def resolve_all_conflicts(self, version, group):
+    # The implementation before only the first conflict of an unranked
+    # target was tracked. It examines the or-groups depending on the
+    # target again for every conflict.
+    kind, or_group, targets = group
+    for target in targets:
+        version.conflicts = (version.conflicts or []) + [target.id]
+        target.conflicts = (target.conflicts or []) + [version.id]
+        for subject in target.notify or ():
+            if self._Manager__versions[subject].unresolved:
+                self._Manager__pending_depends.add(subject)
+                self._Manager__pushes += 1
+
+@pytest.mark.parametrize('seed', range(3))
+def test_first_conflicts_only(monkeypatch, seed):
+    universe = aptorphan_fake.Universe(2000, seed=seed, or_ratio=0.4, conflicts_ratio=0.3, upgrade_ratio=0.2)
+    def run():
+        manager = aptorphan.Manager(aptorphan.Repository(universe.snapshot()))
+        for name in universe.names[::9]:
+            manager.rank_by_name(name, 'W')
+        manager.rank_unresolved()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            manager.dump_unresolved()
+        return output.getvalue(), manager.stats()['pending pushes']
+    text, pushes = run()
+    monkeypatch.setattr(aptorphan.Manager, '_Manager__resolve_conflicts', resolve_all_conflicts)
+    reference, reference_pushes = run()
+    assert text == reference
+    assert pushes < reference_pushes
+
+@pytest.fixture
+def state_files(tmp_path):
+    # Points the key files of the checkpoint to the temporary directory.
+    names = ['Dir::Cache::srcpkgcache', 'Dir::State::lists']
+    previous = [ apt_pkg.config.find(name) for name in names ]
+    (tmp_path / 'lists').mkdir()
+    apt_pkg.config.set(names[0], str(tmp_path / 'srcpkgcache.bin'))
+    apt_pkg.config.set(names[1], str(tmp_path / 'lists'))
+    yield tmp_path
+    for name, value in zip(names, previous):
+        apt_pkg.config.set(name, value)
+
+def test_checkpoint_without_key_file(state_files):
+    # The checkpoint would fail to restore, but without srcpkgcache.bin
+    # it is neither used nor replaced.
+    universe = aptorphan_fake.Universe(1500, seed=1)
+    pathname = str(state_files / 'checkpoint')
+    key = aptorphan_incremental.make_key(aptorphan_incremental.find_state_files(apt_pkg.config))
+    aptorphan_incremental.save(pathname, key, (), 'invalid')
+    args = types.SimpleNamespace(checkpoint=True, checkpoint_file=pathname)
+    manager = aptorphan.create_manager(args, aptorphan.Repository(universe.snapshot()), aptorphan_profile.Profiler())
+    assert manager.ranked_versions()
+    with open(pathname, 'rb') as f:
+        pickle.load(f)
+        assert pickle.load(f) == 'invalid'
+    (state_files / 'srcpkgcache.bin').write_bytes(b'cache')
+    aptorphan.create_manager(args, aptorphan.Repository(universe.snapshot()), aptorphan_profile.Profiler())
+    checkpoint = aptorphan_incremental.load(pathname, aptorphan_incremental.find_state_files(apt_pkg.config), ())[0]
+    assert checkpoint == manager.export_checkpoint()
+
+def test_multi_profiles(monkeypatch, tmp_path, capsys):
+    # Profiles with the same file name in different directories are
+    # told apart, and a failed profile sets the exit status.
+    universe = aptorphan_fake.Universe(1500, seed=1)
+    monkeypatch.setattr(aptorphan_snapshot, 'open_snapshot', lambda apt_pkg, pathname=None, jobs=1: universe.snapshot())
+    monkeypatch.chdir(tmp_path)
+    for directory, wishlist in [('a', universe.names[::100]), ('b', ['unknown'])]:
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / 'x.conf').write_text(repr(wishlist))
+    def run(*configs):
+        monkeypatch.setattr(sys, 'argv', ['aptorphan.py', '--snapshot', '--multi', '--jobs', '2'] + list(configs))
+        with pytest.raises(SystemExit) as e:
+            runpy.run_path(os.path.join(ROOT, 'aptorphan.py'), run_name='__main__')
+        return e.value.code, capsys.readouterr().out
+    code, output = run('a/x.conf')
+    assert code == 0
+    assert output.startswith('PROFILE: a/x.conf\n')
+    code, output = run('a/x.conf', 'b/x.conf')
+    assert code == 1
+    assert 'PROFILE: b/x.conf\nERROR: unknown package: unknown\n' in output
+    with pytest.raises(Exception, match='duplicate profiles: a/x.conf'):
+        run('a/x.conf', 'b/x.conf', 'a/x.conf')
+    # The error records are written like all other records.
+    code, output = run('--format', 'jsonl', 'a/x.conf', 'b/x.conf')
+    assert code == 1
+    records = [ json.loads(line) for line in output.splitlines() ]
+    assert output.splitlines() == [ json.dumps(record, separators=(',', ':')) for record in records ]
+    assert {'profile': 'b/x.conf', 'action': 'error', 'error': 'unknown package: unknown'} in records
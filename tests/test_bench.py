@@ -0,0 +1,15 @@
+import pytest
+
+from conftest import load_script
+
+apt_pkg = pytest.importorskip('apt_pkg')
+
+bench = load_script('aptorphan-bench.py')
+graph = load_script('aptorphan-graph.py')
+
+@pytest.mark.parametrize('size, seed, options, digest', bench.EXPECTED)
+def test_digest(size, seed, options, digest):
+    # The ranking, the report and the resolution of the graph have to
+    # be identical to the recorded results.
+    generated, best, digests = bench.bench(graph, size, seed, **options)
+    assert digests == {digest}
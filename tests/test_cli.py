@@ -0,0 +1,49 @@
+import os
+import runpy
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+apt_pkg = pytest.importorskip('apt_pkg')
+
+import aptorphan_fake
+import aptorphan_snapshot
+
+@pytest.fixture
+def cli(monkeypatch, tmp_path):
+    # Runs aptorphan-cli.py in this process against a synthetic
+    # universe and returns the files written with --output.
+    universe = aptorphan_fake.Universe(3000, seed=1)
+    monkeypatch.setattr(aptorphan_snapshot, 'open_snapshot', lambda apt_pkg, pathname=None, jobs=1: universe.snapshot())
+    monkeypatch.chdir(tmp_path)
+    for name, step in [('w2.conf', 2), ('w3.conf', 3)]:
+        (tmp_path / name).write_text(repr(universe.names[::step * 100]))
+    def run(*args):
+        monkeypatch.setattr(sys, 'argv', ['aptorphan-cli.py', '--snapshot'] + list(args))
+        with pytest.raises(SystemExit) as e:
+            runpy.run_path(os.path.join(ROOT, 'aptorphan-cli.py'), run_name='__main__')
+        assert e.value.code == 0
+        # The order of the nodes and edges depends on the hashes of the
+        # objects, and only the lines are compared.
+        outputs = [ name for option, name in zip(args, args[1:]) if option == '--output' ]
+        return { name: sorted((tmp_path / name).read_text().splitlines()) for name in outputs }
+    return run
+
+def test_graph_twice_equals_standalone(cli):
+    both = cli('graph', '--output', 'a.dot', 'w2.conf', '+', 'graph', '--output', 'b.dot', 'w3.conf')
+    first = cli('graph', '--output', 'c.dot', 'w2.conf')
+    second = cli('graph', '--output', 'd.dot', 'w3.conf')
+    assert both['a.dot'] == first['c.dot']
+    assert both['b.dot'] == second['d.dot']
+
+def test_chained_commands_equal_standalone(cli):
+    # The repository is shared, and the commands must not influence each
+    # other.
+    both = cli('graph', '--output', 'c.dot', 'w3.conf', '+', 'report', '--output', 'a.txt', 'w2.conf',
+               '+', 'conf', '--output', 'b.conf')
+    assert both['a.txt'] and both['b.conf'] and both['c.dot']
+    assert both['a.txt'] == cli('report', '--output', 'd.txt', 'w2.conf')['d.txt']
+    assert both['b.conf'] == cli('conf', '--output', 'e.conf')['e.conf']
+    assert both['c.dot'] == cli('graph', '--output', 'f.dot', 'w3.conf')['f.dot']
@@ -0,0 +1,140 @@
+import types
+
+import aptorphan_dpkg
+import aptorphan_fake
+
+# The constants exported by python-apt 2.6. The trigger states are
+# missing there.
+apt_pkg = types.SimpleNamespace(
+    CURSTATE_NOT_INSTALLED=0, CURSTATE_UNPACKED=1, CURSTATE_HALF_CONFIGURED=2,
+    CURSTATE_HALF_INSTALLED=4, CURSTATE_CONFIG_FILES=5, CURSTATE_INSTALLED=6,
+    SELSTATE_UNKNOWN=0, SELSTATE_INSTALL=1, SELSTATE_HOLD=2, SELSTATE_DEINSTALL=3, SELSTATE_PURGE=4)
+
+STATUS = '''\
+Package: a
+Status: install ok not-installed
+Architecture: amd64
+
+Package: b
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 1.0
+
+Package: c
+Status: install reinstreq half-installed
+Architecture: amd64
+Version: 1.1
+
+Package: d
+Status: install ok unpacked
+Architecture: i386
+Version: 1.2
+
+Package: e
+Status: hold ok half-configured
+Architecture: all
+Version: 1.3
+
+Package: f
+Status: install ok triggers-awaited
+Version: 1.4
+
+Package: g
+Status: purge ok triggers-pending
+Architecture: amd64
+Version: 1.5
+
+Package: h
+Status: unknown ok installed
+Architecture: amd64
+Version: 1.6
+'''
+
+def test_read_status_covers_all_states(tmp_path):
+    pathname = tmp_path / 'status'
+    pathname.write_text(STATUS)
+    assert aptorphan_dpkg.read_status(apt_pkg, str(pathname), 'amd64') == {
+        ('a', 'amd64'): (0, 1, None),
+        ('b', 'amd64'): (5, 3, None),
+        ('c', 'amd64'): (4, 1, '1.1'),
+        ('d', 'i386'): (1, 1, '1.2'),
+        ('e', 'amd64'): (2, 2, '1.3'),
+        ('f', 'amd64'): (7, 1, '1.4'),
+        ('g', 'amd64'): (8, 4, '1.5'),
+        ('h', 'amd64'): (6, 0, '1.6'),
+        }
+
+def test_read_extended_states(tmp_path):
+    pathname = tmp_path / 'extended_states'
+    pathname.write_text('Package: a\nArchitecture: amd64\nAuto-Installed: 1\n\n'
+                        'Package: b\nArchitecture: i386\nAuto-Installed: 0\n\n'
+                        'Package: c\nArchitecture: all\nAuto-Installed: 1\n')
+    assert aptorphan_dpkg.read_extended_states(apt_pkg, str(pathname), 'amd64') == {('a', 'amd64'), ('c', 'amd64')}
+
+def parse_deb822(text):
+    # Reference parser for the Deb822 format, folding continuation
+    # lines like apt_pkg.TagFile does for single-line fields.
+    for chunk in text.split('\n\n'):
+        section = {}
+        name = None
+        for line in chunk.splitlines():
+            if line[:1] in (' ', '\t'):
+                section[name] += ' ' + line.strip()
+            elif line:
+                name, _, value = line.partition(':')
+                section[name] = value.strip()
+        if section:
+            yield section
+
+def read_status_deb822(text, native):
+    # The implementation before the parser was rewritten, except that
+    # packages in the config-files state have no current version.
+    current_states = aptorphan_dpkg._current_states(apt_pkg)
+    selected_states = aptorphan_dpkg._selected_states(apt_pkg)
+    result = {}
+    for section in parse_deb822(text):
+        want, flag, status = section['Status'].split()
+        current_state = current_states[status]
+        ver_str = section.get('Version') if current_state not in (0, 5) else None
+        arch = section.get('Architecture', 'all')
+        result[(section['Package'], native if arch == 'all' else arch)] = (current_state, selected_states[want], ver_str)
+    return result
+
+def make_status(count):
+    wants = ['install', 'hold', 'deinstall', 'purge', 'unknown']
+    states = ['installed', 'config-files', 'unpacked', 'half-configured', 'half-installed',
+              'triggers-awaited', 'triggers-pending', 'not-installed']
+    stanzas = []
+    for i in range(count):
+        status = '{} ok {}'.format(wants[i % len(wants)], states[i % len(states)])
+        if i % 7 == 0:
+            status = '\n ' + status.replace(' ok ', ' ok\n ')
+        stanzas.append(
+            'Package: pkg{0}\nStatus: {1}\nPriority: optional\nSection: misc\nInstalled-Size: {0}\n'
+            'Maintainer: Somebody <somebody@example.org>\nArchitecture: {2}\nVersion: 1.{0}-1\n'
+            'Depends: libc6 (>= 2.36), libfoo{0} | libbar\n'
+            'Conffiles:\n /etc/pkg{0}/a.conf 0123456789abcdef0123456789abcdef\n'
+            ' /etc/pkg{0}/b.conf 0123456789abcdef0123456789abcdef\n'
+            'Description: package number {0}\n{3}'.format(
+                i, status, ['amd64', 'i386', 'all'][i % 3], ' Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n' * 12))
+    return '\n'.join(stanzas)
+
+def test_read_status_matches_deb822(tmp_path):
+    text = make_status(500) + '\nPackage: last\nStatus: install ok\n  triggers-pending\nVersion: 2.0\n'
+    pathname = tmp_path / 'status'
+    pathname.write_text(text)
+    result = aptorphan_dpkg.read_status(apt_pkg, str(pathname), 'amd64')
+    assert result == read_status_deb822(text, 'amd64')
+    assert result[('last', 'amd64')] == (8, 1, '2.0')
+
+def test_read_status_of_universe(tmp_path):
+    # The parsing time is measured by aptorphan-bench.py with the
+    # status files of the synthetic universes.
+    universe = aptorphan_fake.Universe(3000, seed=1)
+    pathname = tmp_path / 'status'
+    pathname.write_text(universe.status())
+    expected = {
+        (p.name, p.architecture): (p.current_state, p.selected_state, p.current_ver and p.current_ver.ver_str)
+        for p in universe.snapshot().packages if p.current_state != 0 }
+    assert expected
+    assert aptorphan_dpkg.read_status(apt_pkg, str(pathname), 'amd64') == expected
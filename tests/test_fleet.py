@@ -0,0 +1,65 @@
+import json
+import os
+import runpy
+import sys
+
+import pytest
+
+from conftest import ROOT, load_script
+
+apt_pkg = pytest.importorskip('apt_pkg')
+
+import aptorphan
+import aptorphan_fake
+import aptorphan_snapshot
+
+fleet_script = load_script('aptorphan-fleet.py')
+
+@pytest.fixture
+def fleet(monkeypatch, tmp_path, capsys):
+    # Runs aptorphan-fleet.py in this process against a synthetic
+    # universe and returns the exit status and the output.
+    universe = aptorphan_fake.Universe(1500, seed=1)
+    monkeypatch.setattr(aptorphan_snapshot, 'open_snapshot', lambda apt_pkg, pathname=None, jobs=1: universe.snapshot())
+    (tmp_path / 'base.conf').write_text(repr(universe.names[::100]))
+    (tmp_path / 'status').write_text(universe.status())
+    def run(manifest, *options):
+        (tmp_path / 'manifest').write_text(repr(manifest))
+        monkeypatch.setattr(sys, 'argv', ['aptorphan-fleet.py', '--snapshot', '--jobs', '2'] + list(options) + [str(tmp_path / 'manifest')])
+        with pytest.raises(SystemExit) as e:
+            runpy.run_path(os.path.join(ROOT, 'aptorphan-fleet.py'), run_name='__main__')
+        return e.value.code, capsys.readouterr().out
+    return run
+
+def test_exit_status(fleet):
+    code, output = fleet({'a': {'status': 'status', 'configs': ['base.conf']}})
+    assert code == 0
+    assert output.startswith('HOST: a\n')
+    code, output = fleet({'a': {'status': 'status', 'configs': ['base.conf']}, 'b': {'status': 'missing', 'configs': ['base.conf']}})
+    assert code == 1
+    assert 'HOST: b\nERROR: ' in output
+
+def test_jsonl_error_records(fleet):
+    # The error records are written like all other records.
+    code, output = fleet({'a': {'status': 'status', 'configs': ['base.conf']}, 'b': {'status': 'missing', 'configs': ['base.conf']}},
+                         '--format', 'jsonl')
+    assert code == 1
+    records = [ json.loads(line) for line in output.splitlines() ]
+    assert output.splitlines() == [ json.dumps(record, separators=(',', ':')) for record in records ]
+    assert [ record['host'] for record in records if record['action'] == 'error' ] == ['b']
+
+def test_wishlists_continue_from_base_ranking(tmp_path):
+    # The second wishlist continues from the checkpoint of the base
+    # ranking, and its report is the same as with a fresh ranking.
+    universe = aptorphan_fake.Universe(2000, seed=2, or_ratio=0.3, conflicts_ratio=0.05, upgrade_ratio=0.1)
+    (tmp_path / 'status').write_text(universe.status())
+    first, second = tuple(universe.names[::90]), tuple(universe.names[5::70])
+    host = ('h', str(tmp_path / 'status'), None, second)
+    fleet = fleet_script.Fleet(aptorphan.Repository(universe.snapshot()))
+    fleet.rank(first)
+    fleet.rank(second)
+    fresh = fleet_script.Fleet(aptorphan.Repository(universe.snapshot()))
+    fresh.rank(second)
+    report, failed = fleet.report(host)
+    assert not failed and 'INSTALL: ' in report
+    assert report == fresh.report(host)[0]
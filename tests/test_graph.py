@@ -0,0 +1,251 @@
+import argparse
+import random
+import re
+
+import pytest
+
+from conftest import load_script
+
+apt_pkg = pytest.importorskip('apt_pkg')
+
+import aptorphan_fake
+import aptorphan_profile
+
+graph = load_script('aptorphan-graph.py')
+
+@pytest.fixture(scope='module')
+def model():
+    universe = aptorphan_fake.Universe(2000, seed=1)
+    return graph.Model(graph.Repository(universe.snapshot()))
+
+def test_versions_by_priority_filtered_by_origin_and_component(model):
+    # The versions of the synthetic universe all come from the origin
+    # 'fake' and the component 'main'.
+    versions = list(model.find_versions_by_priority('standard'))
+    assert versions
+    assert list(model.find_versions_by_priority('standard', origins={'fake'}, components={'main'})) == versions
+    assert list(model.find_versions_by_priority('standard', origins={'other'})) == []
+    assert list(model.find_versions_by_priority('standard', components={'contrib'})) == []
+
+class ReferenceResolver(object):
+    # The implementation before the incremental target selection, which
+    # processes all pending entries in sorted order again and again.
+    def __init__(self):
+        self.__versions = graph.Dict()
+        self.__conflicts = set()
+        self.__pending = []
+    def put(self, version):
+        def handler(source):
+            for kind, targets in version.relates(graph.Global.depends):
+                self.__pending.append((source, targets))
+            for kind, targets in version.relates(graph.Global.conflicts):
+                self.__conflicts.update(targets)
+        self.__versions.compute_if_absent(version, handler)
+    def resolve(self):
+        while True:
+            while self.__resolve_all_trivial_targets():
+                pass
+            if self.__resolve_one_designated_target(graph.Model.Version.is_candidate_version):
+                continue
+            elif self.__resolve_one_designated_target(lambda v: True):
+                continue
+            else:
+                return frozenset(self.__versions)
+    def __resolve_all_trivial_targets(self):
+        progress = False
+        self.__pending.sort(key=lambda t: t[0].package().display_name())
+        self.__pending, pending = [], self.__pending
+        for source, targets in pending:
+            if any(v in self.__versions for v in targets):
+                continue
+            targets = [t for t in targets if t not in self.__conflicts]
+            if len(targets) == 0:
+                pass
+            elif len(targets) == 1 and targets[0].is_candidate_version():
+                self.put(targets[0])
+                progress = True
+            else:
+                self.__pending.append((source, targets))
+        return progress
+    def __resolve_one_designated_target(self, predicate):
+        counter = {}
+        for source, targets in self.__pending:
+            targets = [t for t in targets if predicate(t)]
+            if targets:
+                counter[targets[0]] = counter.get(targets[0], 0) + 1
+        if counter:
+            self.put(sorted(counter.items(), key=lambda item: (-item[1], item[0].package().display_name()))[0][0])
+            return True
+        return False
+
+@pytest.mark.parametrize('seed, options', [
+    (1, {}),
+    (2, {'or_ratio': .4, 'conflicts_ratio': .1}),
+    (3, {'virtual_ratio': .05, 'multiarch_ratio': .2}),
+])
+def test_resolver_matches_reference(seed, options):
+    universe = aptorphan_fake.Universe(2000, seed=seed, **options)
+    model = graph.Model(graph.Repository(universe.snapshot()))
+    roots = [v for priority in graph.Global.priorities for v in model.find_versions_by_priority(priority)]
+    results = []
+    for resolver in (graph.Resolver(), ReferenceResolver()):
+        for version in roots:
+            resolver.put(version)
+        results.append(resolver.resolve())
+    assert len(results[0]) > len(roots)
+    assert results[0] == results[1]
+
+def graph_output(capsys, universe, config, *options):
+    # Runs aptorphan-graph on the universe and returns the DOT graph.
+    parser = argparse.ArgumentParser()
+    graph.add_arguments(parser)
+    args = parser.parse_args(list(options))
+    capsys.readouterr()
+    graph.run(args, graph.Repository(universe.snapshot()), aptorphan_profile.Profiler(), graph.Dict(config))
+    return capsys.readouterr().out
+
+def run_graph(capsys, universe, config, *options):
+    # Returns the kinds of the shown versions by their node ids.
+    colors = {'#e6f5c9': 'anchor', '#fdcdac': 'guards', '#f2f2f2': 'missing', '#f4cae4': 'spurious'}
+    nodes = {}
+    for match in re.finditer(r'^    "([^"]*)" \[color="([^"]*)"', graph_output(capsys, universe, config, *options), re.MULTILINE):
+        if match.group(2) in colors and ':' not in match.group(1): # no forks
+            nodes[match.group(1)] = colors[match.group(2)]
+    return nodes
+
+def test_anchors_match_forward_search(capsys):
+    universe = aptorphan_fake.Universe(2000, seed=2, upgrade_ratio=0.1)
+    config = {name: ['test.conf'] for name in universe.names[::40]}
+    nodes = run_graph(capsys, universe, config)
+
+    # The anchors as found before the reverse index, by expanding the
+    # dependencies of all candidates again for each level.
+    model = graph.Model(graph.Repository(universe.snapshot()))
+    selected = {v for name in config for v in model.find_candidate_versions_by_name(name)}
+    selected |= {v for priority in graph.Global.priorities for v in model.find_versions_by_priority(priority)}
+    resolver = graph.Resolver()
+    for version in selected:
+        resolver.put(version)
+    expected = set(resolver.resolve())
+    actual = set(model.find_installed_versions())
+    missing = expected - actual
+    def find_parents(candidates, children):
+        for candidate in candidates:
+            for kind, targets in candidate.relates(graph.Global.depends):
+                if any(target in children for target in targets):
+                    yield candidate
+    anchors = set()
+    anchors_aux = set(find_parents(expected & actual, missing - selected))
+    while anchors_aux:
+        anchors.update(anchors_aux)
+        anchors_aux = set(find_parents((expected & actual) - anchors, anchors_aux - selected))
+    guards = {t for a in anchors for kind, targets in a.relates(graph.Global.depends) for t in targets if t in missing}
+    guards |= missing & selected
+
+    assert anchors and guards
+    assert {id for id, kind in nodes.items() if kind == 'anchor'} == {str(v.id()) for v in anchors}
+    assert {id for id, kind in nodes.items() if kind == 'guards'} == {str(v.id()) for v in guards}
+    assert {id for id, kind in nodes.items() if kind == 'missing'} == {str(v.id()) for v in missing - guards}
+
+def test_candidate_versions_by_pattern(model):
+    names = [ v.package().display_name() for v in model.find_candidate_versions_by_name('pkg00001?') ]
+    assert names == ['pkg0000{:02d}'.format(i) for i in range(10, 20)]
+    assert model.find_candidate_versions_by_name('/pkg0000(12|34)/') == (
+        model.find_candidate_versions_by_name('pkg000012') + model.find_candidate_versions_by_name('pkg000034'))
+    with pytest.raises(Exception, match='no package matches'):
+        model.find_candidate_versions_by_name('nothing*')
+
+def random_graph(seed, size=40, degree=1.5):
+    rnd = random.Random(seed)
+    edges = { node: sorted(set(rnd.randrange(size) for i in range(rnd.randrange(int(2 * degree) + 1)))) for node in range(size) }
+    return list(range(size)), edges.__getitem__
+
+def reachable(successors, node):
+    # All nodes reachable from the node by at least one edge.
+    result = set()
+    children = list(successors(node))
+    while children:
+        child = children.pop()
+        if child not in result:
+            result.add(child)
+            children.extend(successors(child))
+    return result
+
+@pytest.mark.parametrize('seed', range(5))
+def test_components_in_reverse_topological_order(seed):
+    nodes, successors = random_graph(seed)
+    components = graph.find_components(nodes, successors)
+    assert sorted(node for component in components for node in component) == nodes
+    number = { node: n for n, component in enumerate(components) for node in component }
+    for node in nodes:
+        for other in reachable(successors, node):
+            # mutually reachable nodes are in the same component, and
+            # reachable components come first
+            assert (number[other] == number[node]) == (node in reachable(successors, other))
+            assert number[other] <= number[node]
+    assert any(len(component) > 1 for component in components)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_redundant_edges_are_implied(seed):
+    nodes, successors = random_graph(seed, degree=2)
+    components = graph.find_components(nodes, successors)
+    redundant = graph.find_redundant_edges(components, successors)
+    number = { node: n for n, component in enumerate(components) for node in component }
+    for node in nodes:
+        for child in successors(node):
+            # implied, if the component of the child can be reached
+            # through another component
+            others = { other for member in components[number[node]] for other in successors(member)
+                       if number[other] not in (number[node], number[child]) }
+            implied = any(number[child] in { number[n] for n in reachable(successors, other) } for other in others)
+            assert ((node, child) in redundant) == implied
+    assert redundant
+
+def test_max_nodes(capsys):
+    universe = aptorphan_fake.Universe(2000, seed=2, upgrade_ratio=0.1)
+    config = {name: ['test.conf'] for name in universe.names[::40]}
+    nodes = run_graph(capsys, universe, config)
+    pruned = run_graph(capsys, universe, config, '--max-nodes', '50')
+    assert len(nodes) > 50 and len(pruned) == 50
+    # The guards are kept first.
+    guards = { id for id, kind in nodes.items() if kind == 'guards' }
+    assert guards <= set(pruned) or set(pruned) <= guards
+    assert '"{} more versions"'.format(len(nodes) - 50) in graph_output(capsys, universe, config, '--max-nodes', '50')
+
+@pytest.mark.parametrize('option', ['--reduce', '--collapse'])
+def test_reduce_and_collapse_drop_edges(capsys, option):
+    universe = aptorphan_fake.Universe(2000, seed=3)
+    config = {name: ['test.conf'] for name in universe.names[::20]}
+    full = graph_output(capsys, universe, config)
+    pruned = graph_output(capsys, universe, config, option)
+    edges = lambda text: { line for line in text.splitlines() if ' -> ' in line }
+    assert edges(pruned) and len(edges(pruned)) < len(edges(full))
+    if option == '--collapse':
+        assert 'peripheries="2"' in pruned
+    else:
+        assert edges(pruned) < edges(full)
+        assert run_graph(capsys, universe, config, option) == run_graph(capsys, universe, config)
+
+def test_focus(capsys):
+    universe = aptorphan_fake.Universe(2000, seed=2, upgrade_ratio=0.1)
+    config = {name: ['test.conf'] for name in universe.names[::40]}
+    full = run_graph(capsys, universe, config)
+    name = universe.names[80]
+    model = graph.Model(graph.Repository(universe.snapshot()))
+    own = { str(v.id()) for v in model.find_versions_by_name(name) }
+    focused = [ run_graph(capsys, universe, config, '--focus', name, '--depth', str(depth)) for depth in range(4) ]
+    assert set(focused[0]) <= own
+    for smaller, larger in zip(focused, focused[1:]):
+        assert set(smaller) <= set(larger)
+    assert len(focused[-1]) > len(focused[0])
+    # Missing and spurious versions are the same as in the whole graph,
+    # but whether a missing version is guarded depends on the anchors
+    # within the neighbourhood.
+    for id, kind in focused[-1].items():
+        if kind == 'spurious':
+            assert full[id] == kind
+        elif kind in ('missing', 'guards'):
+            assert full[id] in ('missing', 'guards')
+    assert any(kind != 'anchor' for kind in focused[-1].values())
+    with pytest.raises(Exception, match='unknown package'):
+        run_graph(capsys, universe, config, '--focus', 'nothing')
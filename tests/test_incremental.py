@@ -0,0 +1,51 @@
+import os
+
+import aptorphan_incremental
+
+def test_state_is_keyed_on_all_files(tmp_path):
+    srcpkgcache = tmp_path / 'srcpkgcache.bin'
+    srcpkgcache.write_bytes(b'cache')
+    lists = tmp_path / 'lists'
+    lists.mkdir()
+    (lists / 'Packages').write_bytes(b'packages')
+    files = ((str(srcpkgcache), str(lists)), ())
+    pathname = str(tmp_path / 'state')
+    aptorphan_incremental.save(pathname, aptorphan_incremental.make_key(files), ('a',), 'state')
+    assert aptorphan_incremental.load(pathname, files, ('a',))[0] == 'state'
+    assert aptorphan_incremental.load(pathname, files, ('b',))[0] is None
+    # An update replaces the lists.
+    (lists / 'Packages.new').write_bytes(b'updated')
+    os.replace(lists / 'Packages.new', lists / 'Packages')
+    assert aptorphan_incremental.load(pathname, files, ('a',))[0] is None
+
+def test_state_without_key_file_is_never_reused(tmp_path):
+    # E.g. if Dir::Cache::srcpkgcache is set to "" like in the Debian
+    # container images.
+    lists = tmp_path / 'lists'
+    lists.mkdir()
+    files = ((str(tmp_path / 'srcpkgcache.bin'), str(lists)), ())
+    pathname = str(tmp_path / 'state')
+    key = aptorphan_incremental.make_key(files)
+    assert not aptorphan_incremental.is_complete(key)
+    aptorphan_incremental.save(pathname, key, (), 'state')
+    assert aptorphan_incremental.load(pathname, files, ())[0] is None
+
+def test_state_is_keyed_on_preferences(tmp_path):
+    # Pinning changes the candidate versions without touching the lists.
+    srcpkgcache = tmp_path / 'srcpkgcache.bin'
+    srcpkgcache.write_bytes(b'cache')
+    (tmp_path / 'lists').mkdir()
+    (tmp_path / 'preferences.d').mkdir()
+    files = ((str(srcpkgcache), str(tmp_path / 'lists')),
+             (str(tmp_path / 'preferences'), str(tmp_path / 'preferences.d')))
+    pathname = str(tmp_path / 'state')
+    key = aptorphan_incremental.make_key(files)
+    assert aptorphan_incremental.is_complete(key)
+    aptorphan_incremental.save(pathname, key, (), 'state')
+    assert aptorphan_incremental.load(pathname, files, ())[0] == 'state'
+    (tmp_path / 'preferences.d' / 'pin').write_text('Package: pkg000002\nPin: version 0.9*\nPin-Priority: 1001\n')
+    state, key = aptorphan_incremental.load(pathname, files, ())
+    assert state is None
+    aptorphan_incremental.save(pathname, key, (), 'state')
+    (tmp_path / 'preferences').write_text('Package: pkg000001\nPin: release a=unstable\nPin-Priority: 900\n')
+    assert aptorphan_incremental.load(pathname, files, ())[0] is None
@@ -0,0 +1,45 @@
+import fnmatch
+import re
+
+import pytest
+
+import aptorphan_names
+
+NAMES = ['fonts-noto', 'fonts-noto-cjk', 'fonts-noto-mono', 'fonts-dejavu', 'libc6', 'libc6:i386',
+         'libc6-dev', 'linux-image-6.1.0-13-amd64', 'linux-image-6.1.0-15-amd64', 'linux-image-amd64',
+         'python3', 'python3-foo', 'python3-bar', 'python3-foobar', 'colour', 'color']
+
+@pytest.mark.parametrize('entry, expected', [
+    ('libc6', False),
+    ('fonts-noto-*', True),
+    ('python?', True),
+    ('libc[0-9]', True),
+    ('/python3-(foo|bar)/', True),
+    ('/', False),
+    ('//', False),
+])
+def test_is_pattern(entry, expected):
+    assert aptorphan_names.is_pattern(entry) == expected
+
+@pytest.mark.parametrize('entry', [
+    'fonts-noto-*', 'fonts-noto*', '*-amd64', 'libc6*', 'libc6:*', '*:i386', 'python3-???', 'libc[0-9]',
+    '/python3-(foo|bar)/', '/python3-foo(bar)?/', '/linux-image-[0-9.]+-[0-9]+-amd64/', '/colou?r/',
+    '/libc6.*/', '/libc6:.*/', '/fonts-.*-mono/', '/lib/',
+])
+def test_expand_matches_whole_names(entry):
+    # Compare with matching every name, without the literal prefix.
+    if aptorphan_names.is_regex(entry):
+        match = re.compile(entry[1:-1]).fullmatch
+    else:
+        match = lambda name: fnmatch.fnmatchcase(name, entry)
+    expected = sorted(name for name in NAMES if match(name) and (':' in entry or ':' not in name))
+    assert aptorphan_names.NameIndex(NAMES).expand(entry) == expected
+
+def test_expand_qualified_names_only_with_colon():
+    index = aptorphan_names.NameIndex(NAMES)
+    assert index.expand('libc6*') == ['libc6', 'libc6-dev']
+    assert index.expand('libc6:*') == ['libc6:i386']
+    assert index.expand('/libc6(:i386)?/') == ['libc6', 'libc6:i386']
+
+def test_expand_without_match():
+    assert aptorphan_names.NameIndex(NAMES).expand('fonts-liberation*') == []
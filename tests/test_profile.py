@@ -0,0 +1,69 @@
+import argparse
+import io
+import pstats
+import re
+import tracemalloc
+
+import pytest
+
+import aptorphan_profile
+
+@pytest.fixture
+def traced():
+    # The profiler starts tracemalloc with the memory option, and it is
+    # stopped again, so that the other tests are not slowed down.
+    yield
+    tracemalloc.stop()
+
+def test_disabled():
+    profiler = aptorphan_profile.Profiler()
+    with profiler.phase('a'):
+        pass
+    profiler.switch('b')
+    profiler.switch()
+    profiler.count({'versions': 1})
+    output = io.StringIO()
+    profiler.report(output)
+    assert output.getvalue() == ''
+
+def test_phases_counters_and_memory(traced):
+    profiler = aptorphan_profile.Profiler(enabled=True, memory=True)
+    profiler.switch('small')
+    small = list(range(10))
+    profiler.switch('large')
+    large = [ str(i) for i in range(200000) ]
+    profiler.switch()
+    with profiler.phase('nested'):
+        pass
+    profiler.count({'versions': 2, 'packages': 1})
+    profiler.count({'versions': 3})
+    output = io.StringIO()
+    profiler.report(output)
+    lines = output.getvalue().splitlines()
+    phases = [ re.match(r'profile: (\S+) +wall +[0-9.]+s  cpu +[0-9.]+s  process peak rss +(\d+) KiB \(\+(\d+) KiB\)'
+                        r'  traced +(\d+) KiB  traced peak +(\d+) KiB$', line) for line in lines[:3] ]
+    assert [ match.group(1) for match in phases ] == ['small', 'large', 'nested']
+    # The strings of the large phase take more than 8 MiB.
+    assert int(phases[1].group(5)) > 8 << 10
+    assert int(phases[0].group(5)) < 1 << 10
+    assert int(phases[1].group(2)) >= int(phases[0].group(2))
+    assert lines[3:5] == ['profile: versions: 5', 'profile: packages: 1']
+    assert any(line.startswith('profile: memory: ') for line in lines[5:])
+    assert len(small) + len(large)
+
+def test_hot_phase_is_recorded(tmp_path):
+    parser = argparse.ArgumentParser()
+    aptorphan_profile.add_arguments(parser, ['a', 'b'], 'a')
+    pathname = str(tmp_path / 'profile')
+    profiler = aptorphan_profile.from_arguments(parser.parse_args(['--profile-output', pathname, '--profile-phase', 'b']))
+    assert profiler.enabled
+    def cold():
+        pass
+    def hot():
+        pass
+    with profiler.phase('a'):
+        cold()
+    with profiler.phase('b'):
+        hot()
+    functions = { function for filename, line, function in pstats.Stats(pathname).stats }
+    assert 'hot' in functions and 'cold' not in functions
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+
+import pytest
+
+from conftest import load_script
+
+apt_pkg = pytest.importorskip('apt_pkg')
+
+import aptorphan
+import aptorphan_fake
+import aptorphan_profile
+import aptorphan_repository
+import aptorphan_snapshot
+
+server = load_script('aptorphan-server.py')
+
+@pytest.fixture(scope='module')
+def ranking():
+    universe = aptorphan_fake.Universe(2000, seed=1, or_ratio=0.3, virtual_ratio=0.05)
+    repository = aptorphan.Repository(universe.snapshot())
+    manager = aptorphan.Manager(repository)
+    for name in universe.names[::50]:
+        manager.rank_by_name(name, 'W')
+    manager.rank_unresolved()
+    manager.release()
+    return manager, server.Explorer(repository, manager)
+
+def name_of(v):
+    return v.underlying.parent_pkg.get_fullname(pretty=True)
+
+def children(manager, v):
+    return { target for kind, or_group, targets in manager.groups(v, server.Explorer.depends) for target in targets }
+
+def distances(manager):
+    # The length of the shortest chain from any root to each version.
+    ranked = manager.ranked_versions()
+    queue = collections.deque(v for v in ranked if v.hint in ('W', 'D'))
+    result = dict.fromkeys(queue, 0)
+    while queue:
+        v = queue.popleft()
+        for target in children(manager, v):
+            if target.rank and target not in result:
+                result[target] = result[v] + 1
+                queue.append(target)
+    return result
+
+def test_why_is_shortest_chain(ranking):
+    manager, explorer = ranking
+    found = 0
+    for v, distance in distances(manager).items():
+        response = explorer.why(name_of(v))
+        if response['version'] != v.underlying.ver_str:
+            continue # not the candidate version
+        chain = response['chain']
+        assert len(chain) == distance + 1
+        assert chain[0]['hint'] in ('W', 'D') and chain[0]['kind'] is None
+        assert chain[-1]['package'] == name_of(v)
+        assert all(link['kind'] in server.Explorer.depends for link in chain[1:])
+        found += distance > 1
+    assert found
+
+def test_roots_and_rdepends(ranking):
+    manager, explorer = ranking
+    v = max(distances(manager).items(), key=lambda item: (item[1], item[0].order))[0]
+    why = explorer.why(name_of(v))
+    roots = explorer.roots(name_of(v))['roots']
+    assert why['chain'][0] in [ dict(root, kind=None) for root in roots ]
+    assert all(root['hint'] in ('W', 'D') for root in roots)
+    rdepends = explorer.rdepends(name_of(v))['rdepends']
+    parents = { name_of(p) for p in manager.ranked_versions() if v in children(manager, p) }
+    assert { entry['package'] for entry in rdepends } == parents
+    assert why['chain'][-2]['package'] in parents
+
+def test_rank(ranking):
+    manager, explorer = ranking
+    v = next(v for v in manager.ranked_versions() if v.hint == 'W')
+    assert explorer.rank(name_of(v)) == dict(package=name_of(v), version=v.underlying.ver_str, rank=v.rank, hint='W')
+    with pytest.raises(Exception, match='unknown package'):
+        explorer.rank('nothing')
+
+def test_queries_on_socket(monkeypatch, tmp_path):
+    universe = aptorphan_fake.Universe(2000, seed=1)
+    monkeypatch.setattr(aptorphan_snapshot, 'open_snapshot', lambda apt_pkg, pathname=None, jobs=1: universe.snapshot())
+    config = tmp_path / 'wishlist.conf'
+    config.write_text(repr(universe.names[::50]))
+    parser = argparse.ArgumentParser()
+    aptorphan_repository.add_arguments(parser)
+    parser.add_argument('configs', nargs='*')
+    instance = server.Server(parser.parse_args(['--snapshot', str(config)]), aptorphan_profile.Profiler())
+    instance.load()
+    assert not instance.is_outdated()
+
+    async def query(*lines):
+        pathname = str(tmp_path / 'aptorphan.sock')
+        async with await asyncio.start_unix_server(instance.handle, path=pathname):
+            reader, writer = await asyncio.open_unix_connection(pathname)
+            writer.write(''.join(line + '\n' for line in lines).encode())
+            writer.write_eof()
+            responses = [ json.loads(await reader.readline()) for line in lines ]
+            assert await reader.read() == b'' # closed by the server
+            writer.close()
+            return responses
+    rank, unknown, command = asyncio.run(query('rank ' + universe.names[50], 'why nothing', 'depends libc6'))
+    assert rank['package'] == universe.names[50] and rank['rank']
+    assert unknown == {'error': 'unknown package: nothing'}
+    assert command == {'error': 'unknown command: depends'}
+
+    # The configuration files are polled like the APT state files, and
+    # only a changed content counts.
+    stat = os.stat(config)
+    os.utime(config, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not instance.is_outdated()
+    config.write_text(repr(universe.names[::60]))
+    assert instance.is_outdated()
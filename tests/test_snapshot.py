@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import pickle
+import types
+
+import pytest
+
+import aptorphan_fake
+import aptorphan_snapshot
+
+def test_capture_reproduces_tables():
+    # A snapshot provides the interface of apt_pkg.Cache and
+    # apt_pkg.DepCache, so capturing it has to yield the same rows.
+    universe = aptorphan_fake.Universe(2000, seed=1, or_ratio=0.3, virtual_ratio=0.05)
+    architectures, packages, versions = universe.tables()
+    snapshot = universe.snapshot()
+    captured = aptorphan_snapshot.capture(snapshot, snapshot, architectures)
+    assert captured[1] == packages
+    assert sorted(captured[2]) == sorted(versions)
+
+def test_capture_in_worker_processes():
+    universe = aptorphan_fake.Universe(2000, seed=1, or_ratio=0.3, virtual_ratio=0.05)
+    snapshot = universe.snapshot()
+    expected = aptorphan_snapshot.capture(snapshot, snapshot, universe.architectures)
+    assert aptorphan_snapshot.capture(snapshot, snapshot, universe.architectures, universe.snapshot, 3) == expected
+
+def test_capture_terminates_workers_on_error():
+    universe = aptorphan_fake.Universe(2000, seed=1)
+    snapshot = universe.snapshot()
+    def get_candidate_ver(package):
+        raise KeyboardInterrupt
+    depcache = types.SimpleNamespace(get_candidate_ver=get_candidate_ver)
+    with pytest.raises(KeyboardInterrupt):
+        aptorphan_snapshot.capture(snapshot, depcache, universe.architectures, universe.snapshot, 3)
+    assert multiprocessing.active_children() == []
+
+def test_objects_are_created_on_access():
+    universe = aptorphan_fake.Universe(2000, seed=1)
+    snapshot = universe.snapshot()
+    package = snapshot[universe.names[10]]
+    assert package is snapshot.packages_by_id[package.id]
+    assert snapshot.packages[package.id] is package
+    assert all(v.parent_pkg is package for v in package.version_list)
+
+def state_files(tmp_path):
+    files = [ tmp_path / name for name in ('pkgcache.bin', 'srcpkgcache.bin', 'status', 'extended_states') ]
+    for f in files:
+        f.write_bytes(f.name.encode())
+    return [ str(f) for f in files ]
+
+def test_load_checks_all_files(tmp_path):
+    files = state_files(tmp_path)
+    universe = aptorphan_fake.Universe(500, seed=1)
+    pathname = str(tmp_path / 'snapshot')
+    aptorphan_snapshot.save(pathname, aptorphan_snapshot.make_key(files), universe.tables())
+    assert aptorphan_snapshot.load(pathname, files)[0] is not None
+    # A snapshot taken before the caches were removed.
+    os.unlink(files[0])
+    assert aptorphan_snapshot.load(pathname, files)[0] is None
+    aptorphan_snapshot.save(pathname, aptorphan_snapshot.make_key(files), universe.tables())
+    assert aptorphan_snapshot.load(pathname, files)[0] is None
+
+@pytest.mark.parametrize('content', [
+    b'', # empty
+    pickle.dumps((aptorphan_snapshot.FORMAT, {}))[:-5], # truncated
+    pickle.dumps(None), # other layout
+    pickle.dumps((aptorphan_snapshot.FORMAT - 1, {})) + pickle.dumps(object), # other format
+    ])
+def test_load_falls_back_on_invalid_files(tmp_path, content):
+    files = state_files(tmp_path)
+    pathname = tmp_path / 'snapshot'
+    pathname.write_bytes(content)
+    snapshot, key = aptorphan_snapshot.load(str(pathname), files)
+    assert snapshot is None
+    assert key == aptorphan_snapshot.make_key(files)
+
+def test_load_falls_back_on_invalid_data(tmp_path):
+    files = state_files(tmp_path)
+    pathname = str(tmp_path / 'snapshot')
+    aptorphan_snapshot.save(pathname, aptorphan_snapshot.make_key(files), ('amd64', None))
+    assert aptorphan_snapshot.load(pathname, files)[0] is None
+
+class Config(dict):
+    def find_file(self, name):
+        return self.get(name, '')
+    def find_dir(self, name):
+        return self.get(name, '')
+
+def test_snapshot_checks_preferences(tmp_path):
+    # The preferences select the candidate versions. A missing file is
+    # fine, as long as it is still missing.
+    universe = aptorphan_fake.Universe(500, seed=1)
+    opened = []
+    def open_cache(progress):
+        opened.append(progress)
+        return universe.snapshot()
+    names = ['Dir::Cache::pkgcache', 'Dir::Cache::srcpkgcache', 'Dir::State::status', 'Dir::State::extended_states']
+    config = Config(zip(names, state_files(tmp_path)))
+    config['Dir::Etc::preferences'] = str(tmp_path / 'preferences')
+    config['Dir::Etc::preferencesparts'] = str(tmp_path / 'preferences.d')
+    (tmp_path / 'preferences.d').mkdir()
+    apt_pkg = types.SimpleNamespace(config=config, Cache=open_cache, DepCache=lambda cache: cache,
+                                    get_architectures=lambda: universe.architectures)
+    pathname = str(tmp_path / 'snapshot')
+    def reopened():
+        del opened[:]
+        aptorphan_snapshot.open_snapshot(apt_pkg, pathname)
+        return bool(opened)
+    assert reopened()
+    assert not reopened()
+    (tmp_path / 'preferences').write_text('Package: pkg000001\nPin: release a=unstable\nPin-Priority: 900\n')
+    assert reopened()
+    assert not reopened()
+    (tmp_path / 'preferences.d' / 'pin').write_text('Package: pkg000002\nPin: version 0.9*\nPin-Priority: 1001\n')
+    assert reopened()
+    assert not reopened()